@@ -1,93 +1,747 @@
+import contextlib
+import heapq
+import json
 import pickle
+import sys
+import time
 from collections import UserDict
-from datetime import datetime, timedelta
-import re
-from colorama import init, Fore
+from datetime import date
+import metrics
+import validators
+from indexes import (BirthdayIndex, HashIndex, PrefixIndex, connected_groups,
+                     decode_token, encode_token, normalize_email,
+                     normalize_phone)
+from search import TrigramIndex
+from storage import (ROWS, JournalStorage, MappedSnapshot, PickledBookError,
+                     ShardedStorage, apply_change)
+
+
+PAGE_SIZE = 20
+USER_EXIT_LIST = ['good bye', 'close', 'exit', '.']
+NAME_ERROR = "Contact name must not contain a NUL character."
+PHONE_ERROR = ("Incorrect phone number format entered.\n"
+               "Enter your phone in the format '+380991122333'")
+EMAIL_ERROR = ("Email entered incorrectly.\n"
+               "Please enter a valid email: 'example@gmail.com'")
+BIRTHDAY_ERROR = ("Birthday invalid.\n"
+                  "Birthday should be in the format\n"
+                  "'day.month.year' and less than current date.")
 
 
 class AddressBook(UserDict):
     file_name = 'AddressBook.bin'
 
+    def __init__(self, *args, storage=None, flush_every=1,
+                 flush_interval=None, unique=False, history=100, **kwargs):
+        self.storage = storage or JournalStorage(self.file_name,
+                                                 record_type=Record)
+        # With unique, a phone number or email belongs to one contact.
+        self.unique = unique
+        # Unsaved changes, coalesced to the last operation per record.
+        self.pending = {}
+        self.cleared = False
+        self.generation = 0
+        self.saved_generation = 0
+        self.first_unsaved = None
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        # Contacts whose unsaved change was dropped because another
+        # process saved a change to them first.
+        self.conflicts = []
+        # Undo log: each step is a list of (name, before, after) changes,
+        # steps before position are applied and the rest can be redone.
+        # Changed records are copies, so the log shares every record it
+        # did not change. A clear is one change whose before is the old
+        # mapping and whose name is None; a rename's name is (old, new).
+        self.history = history
+        self.log = []
+        self.position = 0
+        self.log_start = 0
+        self.group = None
+        self.replaying = False
+        self.snapshots = {}
+        # Integer ids, handed out on first use and kept for the session: a
+        # rename moves the id to the new name, so a client such as a
+        # server connection can hold on to a contact by id.
+        self.ids = {}
+        self.names = {}
+        self.next_id = 1
+        self.indexes = {
+            'name': PrefixIndex(lambda name: [name], key_only=True),
+            'phone': HashIndex(
+                lambda record: [phone.number for phone in record.phones]),
+            'email': HashIndex(
+                lambda record: [normalize_email(record.email.value)]
+                if record.email else []),
+            'birthday': BirthdayIndex(birthday_month_day),
+            'search': TrigramIndex(search_terms),
+        }
+        self.stale = set()
+        super().__init__(*args, **kwargs)
+
     def show_all_records(self):
         return self.data
 
-    def iterate(self, n=1):
-        for key, value in self.data.items():
-            d_list = list(self.data.values())
-            for i in range(0, len(d_list), n):
-                yield key, d_list[i:i + n]
+    def iterate(self, n=1, sort_by=None, token=None):
+        return metrics.traced_iter('iterate',
+                                   self.iter_pages(n, sort_by, token))
+
+    def iter_pages(self, n, sort_by, token):
+        after = decode_token(token, sort_by)
+        page = []
+        for position, name in self.walk(sort_by, after):
+            page.append((name, self.data[name]))
+            if len(page) == n:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    @metrics.traced('page')
+    def page(self, n=10, token=None, sort_by=None):
+        after = decode_token(token, sort_by)
+        page = []
+        for position, name in self.walk(sort_by, after):
+            if len(page) == n:
+                return page, encode_token(sort_by, after)
+            page.append((name, self.data[name]))
+            after = position
+        return page, None
+
+    def walk(self, sort_by=None, after=None):
+        # Pages resume after the last key they gave by bisecting a sorted
+        # table, so the default order is name order and a late page costs
+        # no more than the first.
+        if sort_by is None or sort_by == 'name':
+            yield from self.walk_names(after)
+        elif sort_by == 'birthday':
+            index = self.index('birthday')
+            if after is None or after[0] < 366:
+                yield from index.walk(after)
+                after = None
+            for position, name in self.walk_names(
+                    after and [after[1], after[1]]):
+                if name not in index.keys:
+                    yield [366, name], name
+        else:
+            raise ValueError(f'Unknown sort key {sort_by!r}')
+
+    def walk_names(self, after=None):
+        # Until the name index is built, a mapped book merges the sorted
+        # snapshot table with the names added since, so the first page of
+        # 'show' does not wait for the whole index.
+        base = getattr(self.data, 'base', None)
+        if 'name' not in self.stale or not isinstance(base, MappedSnapshot):
+            yield from self.index('name').walk(after)
+            return
+        key = after[1] if after else None
+        added = sorted(name for name in self.data.new
+                       if key is None or name > key)
+        removed = self.data.removed
+        for name in heapq.merge((name for name in base.names_after(key)
+                                 if name not in removed), added):
+            yield [name, name], name
 
+    @metrics.traced('add_record')
     def add_record(self, record):
-        self.data[record.name.value] = record
+        name = record.name.value
+        self.check_unique(name, record)
+        self.record_change(name, self.data.get(name), record)
+        self.data[name] = record
+        self.index_record(name, record)
+        self.mark(name, ('put', name, record))
+
+    @metrics.traced('add_records')
+    def add_records(self, records):
+        """Add many records; returns (record, error) for those refused."""
+        if self.unique:
+            rejected = []
+            with self.operation():
+                for record in records:
+                    try:
+                        self.add_record(record)
+                    except ValueError as error:
+                        rejected.append((record, str(error)))
+            return rejected
+        # Bulk loads rebuild the indexes once instead of per record.
+        with self.operation():
+            for record in records:
+                name = record.name.value
+                self.record_change(name, self.data.get(name), record)
+                self.data[name] = record
+                self.mark(name, ('put', name, record))
+        if records:
+            self.stale = set(self.indexes)
+        return []
+
+    def update_record(self, name, record):
+        self.check_unique(name, record)
+        self.record_change(name, self.data.get(name), record)
+        self.data[name] = record
+        self.index_record(name, record)
+        self.mark(name, ('put', name, record))
+
+    def remove_record(self, name):
+        record = self.data.pop(name)
+        self.record_change(name, record, None)
+        for index in self.fresh_indexes():
+            index.discard(name)
+        self.mark(name, ('del', name))
+        self.names.pop(self.ids.pop(name, None), None)
+        return record
+
+    def rename_record(self, old, new, record=None):
+        """Move the contact at old to new; it keeps its id.
+
+        record is what gets stored under new, by default a copy of the
+        contact with the new name. The old key is dropped from the book,
+        the pending changes and every built index in the same call, and
+        undo sees a single change.
+        """
+        if new in self.data:
+            raise ValueError(f'Contact {new} already exists')
+        before = self.data[old]
+        if record is None:
+            record = before.copy()
+            record.name = Name(new)
+        self.check_unique(old, record)
+        self.record_change((old, new), before, record)
+        del self.data[old]
+        self.data[new] = record
+        for index in self.fresh_indexes():
+            index.discard(old)
+            index.add(new, record)
+        self.mark(old, ('del', old))
+        self.mark(new, ('put', new, record))
+        record_id = self.ids.pop(old, None)
+        if record_id is not None:
+            self.ids[new] = record_id
+            self.names[record_id] = new
+        return record
+
+    def clear_records(self):
+        if not self.replaying:
+            # Undoing a clear needs the old records, so keep them all.
+            self.record_change(None, dict(self.data.items()), None)
+        self.data.clear()
+        for index in self.indexes.values():
+            index.clear()
+        self.stale = set()
+        self.ids = {}
+        self.names = {}
+        self.pending = {}
+        self.cleared = True
+        self.touch()
+
+    def record_change(self, name, before, after):
+        if self.replaying or not self.history:
+            return
+        if self.group is not None:
+            self.group.append((name, before, after))
+        else:
+            self.add_step([(name, before, after)])
+
+    @contextlib.contextmanager
+    def operation(self):
+        """Make every change inside the block a single undo step."""
+        if self.group is not None:
+            yield
+            return
+        self.group = []
+        try:
+            yield
+        finally:
+            group, self.group = self.group, None
+            if group:
+                self.add_step(group)
+
+    def add_step(self, changes):
+        # A new step drops the steps that could be redone, and with them
+        # the snapshots taken there.
+        del self.log[self.position:]
+        end = self.log_start + self.position
+        self.snapshots = {label: position for label, position
+                          in self.snapshots.items() if position <= end}
+        self.log.append(changes)
+        self.position += 1
+        self.trim_log()
+
+    def trim_log(self):
+        # Named snapshots keep the steps after them alive.
+        keep = min(self.snapshots.values(), default=None)
+        excess = self.position - self.history
+        if keep is not None:
+            excess = min(excess, keep - self.log_start)
+        if excess > 0:
+            del self.log[:excess]
+            self.position -= excess
+            self.log_start += excess
+
+    def apply(self, changes, undo):
+        self.replaying = True
+        try:
+            for name, before, after in (reversed(changes) if undo
+                                        else changes):
+                if undo:
+                    before, after = after, before
+                if name is None:
+                    if undo:
+                        self.data.update(after)
+                        for key, record in after.items():
+                            self.mark(key, ('put', key, record))
+                        self.stale = set(self.indexes)
+                    else:
+                        self.clear_records()
+                elif isinstance(name, tuple):
+                    old, new = reversed(name) if undo else name
+                    self.rename_record(old, new, after)
+                elif after is None:
+                    self.remove_record(name)
+                else:
+                    self.update_record(name, after)
+        finally:
+            self.replaying = False
+
+    def undo(self):
+        if not self.position:
+            return False
+        self.position -= 1
+        self.apply(self.log[self.position], undo=True)
+        return True
+
+    def redo(self):
+        if self.position == len(self.log):
+            return False
+        self.apply(self.log[self.position], undo=False)
+        self.position += 1
+        return True
+
+    def take_snapshot(self, label):
+        """Remember the current state under label; costs no copying."""
+        self.snapshots[label] = self.log_start + self.position
+
+    def restore_snapshot(self, label):
+        target = self.snapshots[label] - self.log_start
+        while self.position > target:
+            self.undo()
+        while self.position < target:
+            self.redo()
+
+    def drop_snapshot(self, label):
+        del self.snapshots[label]
+
+    def mark(self, name, change):
+        self.pending[name] = change
+        self.touch()
+
+    def touch(self):
+        self.generation += 1
+        if self.first_unsaved is None:
+            self.first_unsaved = time.monotonic()
+
+    @property
+    def changes(self):
+        changes = [('clear',)] if self.cleared else []
+        changes.extend(self.pending.values())
+        return changes
+
+    def has_changes(self):
+        return self.generation != self.saved_generation
+
+    def record_id(self, name):
+        """The contact's stable id, or None when there is no such name."""
+        if name not in self.data:
+            return None
+        record_id = self.ids.get(name)
+        if record_id is None:
+            record_id = self.ids[name] = self.next_id
+            self.names[record_id] = name
+            self.next_id += 1
+        return record_id
+
+    def name_of(self, record_id):
+        return self.names[record_id]
+
+    def index(self, kind):
+        index = self.indexes[kind]
+        if kind in self.stale:
+            with metrics.trace(f'index.{kind}'):
+                if not self.warm_start(kind, index):
+                    index.rebuild(self.data)
+            self.stale.discard(kind)
+        return index
+
+    def warm_start(self, kind, index):
+        # A mapped snapshot lists names in order and may store birthday
+        # slots, so those indexes are filled without decoding records;
+        # only the ones changed since are added.
+        base = getattr(self.data, 'base', None)
+        if kind == 'name' and isinstance(base, MappedSnapshot):
+            index.load_sorted(name for name in base
+                              if name not in self.data.removed)
+            for name in self.data.new:
+                index.add(name, None)
+            return True
+        slots = getattr(base, 'birthday_slots', None)
+        if kind != 'birthday' or slots is None:
+            return False
+        pairs = slots()
+        if pairs is None:
+            return False
+        index.load_slots(pairs)
+        for name in self.data.removed:
+            index.discard(name)
+        for name in self.data.changed:
+            index.add(name, self.data.local[name])
+        return True
+
+    def fresh_indexes(self):
+        return [index for kind, index in self.indexes.items()
+                if kind not in self.stale]
+
+    def index_record(self, name, record):
+        for index in self.fresh_indexes():
+            index.add(name, record)
+
+    @metrics.traced('find_records')
+    def find_records(self, query, start=0, limit=None, fuzzy=True):
+        stop = None if limit is None else start + limit
+        names = self.index('search').search(query, stop, fuzzy)
+        return [(name, self.data[name]) for name in names[start:]]
+
+    def check_unique(self, name, record):
+        if not self.unique or self.replaying:
+            return
+        for kind in ('phone', 'email'):
+            for value, other in self.index(kind).conflicts(name, record):
+                raise ValueError(f'{value} already belongs to {other}')
+
+    def find_by_phone(self, phone):
+        number = normalize_phone(phone) or phone
+        return [(name, self.data[name])
+                for name in self.index('phone').lookup(number)]
+
+    def find_by_email(self, email):
+        return [(name, self.data[name]) for name in
+                self.index('email').lookup(normalize_email(email))]
+
+    def duplicate_groups(self):
+        """Names of contacts linked by a shared phone number or email."""
+        return connected_groups(self.index('phone').duplicates()
+                                + self.index('email').duplicates())
+
+    @metrics.traced('scan')
+    def scan(self, predicate, render=None, workers=None):
+        """(name, rendered) for every contact whose row predicate accepts."""
+        import codec
+        import executor
+
+        base = getattr(self.data, 'base', None)
+        if isinstance(base, MappedSnapshot) and base.flags & ROWS:
+            # The snapshot's codec rows go to the scan as they are stored
+            # and are decoded there, in the workers of a parallel scan.
+            rows = self.data.iter_blobs(
+                lambda record: codec.encode_row(record.to_row()))
+            decode = codec.decode_row
+        else:
+            rows = (record.to_row() for name, record in self.data.items())
+            decode = None
+        return [(row[0], line) for row, line in executor.scan(
+            rows, predicate, render, len(self.data), workers,
+            decode=decode)]
+
+    def match_names(self, prefix):
+        return [(name, self.data[name])
+                for name in self.index('name').search(prefix)]
+
+    def columns(self):
+        # Built on first use, as it is the one index that needs NumPy; from
+        # then on it is kept up to date like the others.
+        import columnar
+
+        if not columnar.available:
+            return None
+        if 'columns' not in self.indexes:
+            self.indexes['columns'] = columnar.ColumnarIndex(record_columns)
+            self.stale.add('columns')
+        return self.index('columns')
+
+    @metrics.traced('summary')
+    def summary(self, today=None, days=None):
+        import columnar
 
+        today = today or validators.today()
+        index = self.columns()
+        if index is None:
+            return columnar.summarize(
+                ((name, *record_columns(record))
+                 for name, record in self.data.items()), today, days)
+        return index.summary(today, days)
+
+    def missing_contacts(self, field):
+        if field not in ('phone', 'email', 'birthday'):
+            raise ValueError(f'Unknown field {field!r}')
+        index = self.columns()
+        if index is None:
+            attribute = 'phones' if field == 'phone' else field
+            names = sorted(name for name, record in self.data.items()
+                           if not getattr(record, attribute))
+        else:
+            names = index.missing(field)
+        return [(name, self.data[name]) for name in names]
+
+    @metrics.traced('upcoming_birthdays')
+    def upcoming_birthdays(self, days, today=None):
+        today = today or validators.today()
+        return [(day, name, self.data[name]) for day, name in
+                self.index('birthday').upcoming(today, days)]
+
+    @metrics.traced('save_contacts')
     def save_contacts(self):
-        with open(self.file_name, 'wb') as f:
-            pickle.dump(self.data, f)
-        print(f'Your contact saved!')
+        if not self.has_changes():
+            metrics.count('save_contacts.clean')
+            return False
+        # Other processes' changes come in under the same lock as the
+        # write, so none of them is overwritten unseen.
+        with getattr(self.storage, 'lock', None) or contextlib.nullcontext():
+            self.refresh()
+            self.storage.save(self.data, self.changes)
+        self.pending = {}
+        self.cleared = False
+        self.saved_generation = self.generation
+        self.first_unsaved = None
+        return True
+
+    def maybe_save(self):
+        # Flush once enough changes piled up or the oldest one is too old.
+        if not self.has_changes():
+            return False
+        if self.generation - self.saved_generation >= self.flush_every \
+                or self.flush_due():
+            return self.save_contacts()
+        return False
+
+    def flush_due(self):
+        """True once the oldest unsaved change is flush_interval old."""
+        return self.flush_interval is not None and self.has_changes() and \
+            time.monotonic() - self.first_unsaved >= self.flush_interval
+
+    @metrics.traced('refresh')
+    def refresh(self):
+        """Take in what other processes saved; True if anything changed.
 
+        Only the changed records are read. The first save wins: when
+        another process saved a contact this book changed but has not
+        saved yet, the local change is dropped and the name is added to
+        conflicts.
+        """
+        poll = getattr(self.storage, 'poll', None)
+        if poll is None:
+            return False
+        changes = poll()
+        if changes is None:
+            self.reload()
+            return True
+        for change in changes:
+            self.take_change(change)
+        return bool(changes)
+
+    def take_change(self, change):
+        if self.cleared:
+            # The unsaved clear removes what they saved as well.
+            return
+        if change[0] == 'clear':
+            self.conflicts.extend(self.pending)
+            self.pending = {}
+            self.data.clear()
+            for index in self.indexes.values():
+                index.clear()
+            self.stale = set()
+            self.ids = {}
+            self.names = {}
+            return
+        name = change[1]
+        if self.pending.pop(name, None) is not None:
+            self.conflicts.append(name)
+        apply_change(self.data, change)
+        for index in self.fresh_indexes():
+            index.discard(name)
+            if change[0] == 'put':
+                index.add(name, change[2])
+        if change[0] == 'del':
+            self.names.pop(self.ids.pop(name, None), None)
+
+    def reload(self):
+        # Too far behind to catch up from the journal: load it all again
+        # and put the unsaved changes back on top, as they are newer.
+        data = self.storage.load()
+        if self.cleared:
+            data.clear()
+        for change in self.pending.values():
+            apply_change(data, change)
+        self.data = data
+        self.stale = set(self.indexes)
+
+    @metrics.traced('load_contacts')
     def load_contacts(self):
         try:
-            with open(self.file_name, 'rb') as f:
-                self.data = pickle.load(f)
-        except:
+            self.data = self.storage.load()
+        except PickledBookError:
+            raise
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError):
             return
+        self.pending = {}
+        self.cleared = False
+        self.saved_generation = self.generation
+        self.first_unsaved = None
+        self.log = []
+        self.position = 0
+        self.snapshots = {}
+        self.ids = {}
+        self.names = {}
+        # Indexes are rebuilt on first use, so opening a large book does
+        # not decode every record up front.
+        self.stale = set(self.indexes)
 
 
 class Record:
+    FIELDS = ('name', 'phones', 'email', 'birthday')
+    # _view and _line cache formatting_record() and the display line until
+    # a field is replaced or a phone is added with add_phone.
+    __slots__ = ('_name', '_phones', '_email', '_birthday', '_view', '_line')
+
     def __init__(self, name, phone=None, email=None, birthday=None):
         self.name = name
         self.email = email
         self.birthday = birthday
         self.phones = []
         if phone:
-            self.phones.append(phone)
+            self.add_phone(phone)
             print(self.phones)
 
+    def __getstate__(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def changed(self):
+        self._view = None
+        self._line = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self.changed()
+
+    @property
+    def phones(self):
+        return self._phones
+
+    @phones.setter
+    def phones(self, phones):
+        self._phones = phones
+        self.changed()
+
+    @property
+    def email(self):
+        return self._email
+
+    @email.setter
+    def email(self, email):
+        self._email = email
+        self.changed()
+
+    @property
+    def birthday(self):
+        return self._birthday
+
+    @birthday.setter
+    def birthday(self, birthday):
+        self._birthday = birthday
+        self.changed()
+
+    def to_row(self):
+        return (self.name.value,
+                tuple(phone.value for phone in self.phones),
+                self.email.value if self.email else None,
+                self.birthday.value if self.birthday else None)
+
+    @classmethod
+    def from_row(cls, row):
+        name, phones, email, birthday = row
+        # Every record of a book goes through here on load, so the slots
+        # are filled directly like in __setstate__.
+        record = cls.__new__(cls)
+        record.__setstate__({
+            'name': Name(name),
+            'phones': [Phone(phone) for phone in phones],
+            'email': Email(email) if email else None,
+            'birthday': Birthday(birthday) if birthday else None,
+        })
+        return record
+
+    def __setstate__(self, state):
+        # Slots are set directly: loading a book unpickles every record.
+        self._name = state['name']
+        self._email = state.get('email')
+        self._birthday = state.get('birthday')
+        self._phones = list(state.get('phones', []))
+        self.changed()
+        # 'My bot.py' kept a single phone in a separate attribute.
+        if state.get('phone') and not self.phones:
+            self.add_phone(state['phone'])
+
     def add_phone(self, phone):
         self.phones.append(phone)
+        self.changed()
         # print(self.phones)
 
+    def copy(self):
+        return self.from_row(self.to_row())
+
+    def merge(self, other):
+        numbers = {phone.number for phone in self.phones}
+        for phone in other.phones:
+            if phone.number not in numbers:
+                numbers.add(phone.number)
+                self.add_phone(phone)
+        self.email = self.email or other.email
+        self.birthday = self.birthday or other.birthday
+
     def create_phone(self, record, user_input=None, update=False):
         if user_input:
-            for i in range(10):
-                phone = Phone(user_input)
-                if phone.validate_phone(user_input):
-                    if update:
-                        record.phones = [phone]
-                    else:
-                        record.add_phone(phone)
-                    break
+            phone = Phone(user_input)
+            if phone.validate_phone(user_input):
+                if update:
+                    record.phones = [phone]
                 else:
-                    print("Incorrect phone number format entered.\n"
-                          "Enter your phone in the format '+380991122333'")
-                    user_input = input("Enter contact phone: ")
+                    record.add_phone(phone)
+                return True
+        return False
 
     def create_email(self, record, user_email):
         if user_email:
-            for i in range(10):
-                email = Email(user_email)
-                if email.validate_email(user_email):
-                    record.email = email
-                    break
-                else:
-                    print("Email entered incorrectly.\n"
-                          "Please enter a valid email: 'example@gmail.com'")
-                    user_email = input("Enter contact email: ")
+            email = Email(user_email)
+            if email.validate_email(user_email):
+                record.email = email
+                return True
+        return False
 
     def create_birthday(self, record, user_birthday):
         if user_birthday:
-            for i in range(10):
-                birthday = Birthday(user_birthday)
-                if birthday.validate_birthday(user_birthday):
-                    record.birthday = birthday
-                    break
-                else:
-                    print("Birthday invalid.\n"
-                          "Birthday should be in the format\n"
-                          "'day.month.year' and less than current date.")
-                    user_birthday = input("Enter contact Birthday: ")
+            birthday = Birthday(user_birthday)
+            if birthday.validate_birthday(user_birthday):
+                record.birthday = birthday
+                return True
+        return False
 
     def formatting_record(self, record):
+        if record is not self:
+            return record.formatting_record(record)
+        if self._view is not None:
+            return self._view
         phones = getattr(record, 'phones', '')
         if phones:
             p_l = [phone.value for phone in phones]
@@ -105,12 +759,22 @@ class Record:
         else:
             birthday_val = "Date of birth is missing."
 
-        return {"phone": phone_val, "email": email_val,
-                "birthday": birthday_val}
+        self._view = {"phone": phone_val, "email": email_val,
+                      "birthday": birthday_val}
+        return self._view
 
+    def display_line(self):
+        if self._line is None:
+            rec_data = self.formatting_record(self)
+            self._line = (f"Phone: {rec_data['phone']}, "
+                          f"Email: {rec_data['email']}, "
+                          f"Birthday: {rec_data['birthday']}")
+        return self._line
 
 
 class Field:
+    __slots__ = ('_value',)
+
     def __init__(self, value):
         self._value = value
 
@@ -118,240 +782,910 @@ class Field:
     def value(self):
         return self._value
 
+    def __getstate__(self):
+        return self._value
+
+    def __setstate__(self, state):
+        # Fields pickled before __slots__ carry their old __dict__.
+        if isinstance(state, dict):
+            state = state['_value']
+        self.__init__(state)
+
 
 class Name(Field):
-    pass
+    __slots__ = ()
 
 
 class Phone(Field):
+    __slots__ = ('_number',)
+
+    def __init__(self, value):
+        super().__init__(value)
+        self._number = normalize_phone(value)
+
     @property
     def value(self):
         return self._value
 
     @value.setter
     def value(self, value):
-        if not value.startswith('+'):
-            raise ValueError
-        if len(value) != 13:
+        number = normalize_phone(value)
+        if number is None:
             raise ValueError
+        self._value = value
+        self._number = number
+
+    @property
+    def number(self):
+        return self._number or self._value
 
     def validate_phone(self, phone):
-        pattern = r"^[\+]?3?[\s]?8?[\s]?\(?0\d{2}?\)?" \
-                  r"[\s]?\d{3}[\s|-]?\d{2}[\s|-]?\d{2}$"
-        a = re.match(pattern, phone)
-        if a is not None:
+        if validators.is_phone(phone):
             return phone
 
 
 class Email(Field):
+    __slots__ = ()
 
     def validate_email(self, email):
-        pattern = r"^[-\w\.]+@([-\w]+\.)+[-\w]{2,4}$"
-        a = re.match(pattern, email)
-        if a is not None:
+        if validators.is_email(email):
             return email
 
 
 class Birthday(Field):
+    __slots__ = ('_ordinal',)
+
+    def __init__(self, value):
+        super().__init__(value)
+        self._ordinal = validators.parse_birthday(value)
+
     @property
     def value(self):
         return self._value
 
     @value.setter
-    def set_value(self, value):
-        try:
-            datetime.strptime(value, '%d.%m.%Y')
-        except:
+    def value(self, value):
+        ordinal = validators.parse_birthday(value)
+        if ordinal is None:
             raise ValueError
+        self._value = value
+        self._ordinal = ordinal
+
+    @property
+    def date(self):
+        if self._ordinal is not None:
+            return date.fromordinal(self._ordinal)
+
+    @property
+    def month_day(self):
+        if self._ordinal is not None:
+            bt_date = date.fromordinal(self._ordinal)
+            return bt_date.month, bt_date.day
 
     def validate_birthday(self, birthday):
-        try:
-            bt_obj = datetime.strptime(birthday, '%d.%m.%Y')
-            if bt_obj.date() >= datetime.now().date():
-                return None
+        ordinal = self._ordinal if birthday == self._value else None
+        if validators.is_birthday(birthday, ordinal):
             return birthday
-        except:
-            pass
 
 
-def main():
-    address_book = AddressBook()
-    address_book.load_contacts()
+def search_terms(record):
+    terms = [record.name.value]
+    if record.email:
+        terms.append(record.email.value)
+    terms.extend(phone.number.lstrip('+') for phone in record.phones)
+    return terms
+
+
+def birthday_month_day(record):
+    birthday = getattr(record, 'birthday', None)
+    if birthday:
+        return birthday.month_day
+
+
+def record_columns(record):
+    return (record.birthday.date if record.birthday else None,
+            len(record.phones), bool(record.email))
+
+
+class Result:
+    def __init__(self, ok=True, message='', records=(), token=None,
+                 data=None):
+        self.ok = ok
+        self.message = message
+        self.records = list(records)
+        self.token = token
+        self.data = data or {}
+        # Record ids, parallel to records, when the book hands them out.
+        self.ids = None
+        # Display lines of records, when a scan already rendered them.
+        self.lines = None
+
+    def to_dict(self):
+        records = []
+        for i, (name, record) in enumerate(self.records):
+            row = record.to_row()
+            item = {'name': name, 'phones': list(row[1]),
+                    'email': row[2], 'birthday': row[3]}
+            if self.ids:
+                item['record_id'] = self.ids[i]
+            records.append(item)
+        result = {'ok': self.ok, 'message': self.message,
+                  'records': records}
+        if self.token:
+            result['token'] = self.token
+        result.update(self.data)
+        return result
+
+
+COMMAND_ALIASES = {
+    'show all': 'show',
+    'get bith': 'birthdays',
+    'del all': 'clear',
+    'del': 'delete',
+}
+WRITE_COMMANDS = {'add', 'change', 'delete', 'clear', 'import', 'merge',
+                  'undo', 'redo', 'restore'}
+
+
+def parse_command(text):
+    """Turn 'add John phone=0991122333 email=j@x.com' into a request dict.
+
+    key=value words become fields (repeated phone= words are collected in
+    phones); the remaining words are kept in args.
+    """
+    import shlex
+
+    words = shlex.split(text)
+    if not words:
+        return {}
+    command = words[0].lower()
+    if len(words) > 1 and f'{command} {words[1].lower()}' in COMMAND_ALIASES:
+        command = f'{command} {words[1].lower()}'
+        words = words[1:]
+    request = {'command': COMMAND_ALIASES.get(command, command), 'args': []}
+    for word in words[1:]:
+        key, sep, value = word.partition('=')
+        if not sep:
+            request['args'].append(word)
+        elif key in ('phone', 'phones'):
+            request.setdefault('phones', []).append(value)
+        elif key == 'add_phone':
+            request.setdefault('add_phone', []).append(value)
+        else:
+            request[key] = value
+    return request
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+class CommandEngine:
+    """Runs requests against an address book and returns a Result.
+
+    A request is a dict such as {'command': 'find', 'query': 'An'} or
+    the same command as text, 'find An'. Nothing here reads input() or
+    prints, so the REPL, batch files and other programs share it. With
+    autosave the book's flush policy (maybe_save) runs after every
+    command, so --flush-interval is kept through a run of reads too.
+    """
+
+    def __init__(self, address_book, autosave=False, refresh=False):
+        self.address_book = address_book
+        self.autosave = autosave
+        # With refresh every command first takes in what other processes
+        # saved to the book.
+        self.refresh = refresh and hasattr(address_book, 'refresh')
+
+    def execute(self, request):
+        if isinstance(request, str):
+            request = parse_command(request)
+        command = request.get('command')
+        handler = getattr(self, f'do_{command}', None) if command else None
+        if handler is None:
+            return Result(False, 'Choose the right command!')
+        # A write command is one undo step however many records it changes.
+        operation = getattr(self.address_book, 'operation', None)
+        if operation is None or command not in WRITE_COMMANDS:
+            operation = contextlib.nullcontext
+        if self.refresh:
+            self.address_book.refresh()
+        try:
+            with metrics.trace(f'command.{command}'), operation():
+                result = handler(request)
+        except Exception as error:
+            # A failed command must not end a REPL or batch run with
+            # unsaved changes; whatever it changed stays one undo step.
+            metrics.count(f'command.{command}.failed')
+            return Result(False, f'{command} failed: {error}')
+        record_id = getattr(self.address_book, 'record_id', None)
+        if record_id is not None and result.records:
+            result.ids = [record_id(name) for name, record in result.records]
+        if self.autosave:
+            try:
+                if self.address_book.maybe_save():
+                    result.data['saved'] = True
+            except Exception as error:
+                # The change is kept and saving is tried again later.
+                result.message = '\n'.join(filter(None, [
+                    result.message, f'Saving failed: {error}']))
+        conflicts = self.conflict_message()
+        if conflicts:
+            result.message = '\n'.join(filter(None, [result.message,
+                                                      conflicts]))
+        return result
+
+    def save(self):
+        return self.address_book.save_contacts()
+
+    def flush_due(self):
+        flush_due = getattr(self.address_book, 'flush_due', None)
+        return flush_due is not None and flush_due()
+
+    def conflict_message(self):
+        conflicts = getattr(self.address_book, 'conflicts', None)
+        if not conflicts:
+            return ''
+        names = ', '.join(sorted(set(conflicts)))
+        conflicts.clear()
+        return (f'Another session saved changes to {names} first; '
+                f'your unsaved changes to them were dropped.')
+
+    @staticmethod
+    def text(request, key):
+        value = request.get(key)
+        if value is None and request.get('args'):
+            value = ' '.join(request['args'])
+        return value
+
+    def target(self, request):
+        """Name of the contact a request is about, by name or record_id."""
+        record_id = request.get('record_id')
+        if record_id is not None:
+            try:
+                return self.address_book.name_of(int(record_id))
+            except KeyError:
+                raise ValueError(f'no contact has record_id {record_id}')
+        return self.text(request, 'name')
+
+    def do_stats(self, request):
+        if not metrics.enabled:
+            return Result(False, 'Metrics are off; start with --metrics.')
+        return Result(message=metrics.format_report(),
+                      data={'stats': metrics.report()})
+
+    def do_hello(self, request):
+        return Result(message='How can I help you?')
+
+    def do_add(self, request):
+        name = self.text(request, 'name')
+        if not name:
+            return Result(False, 'Contact name is required')
+        if not validators.is_name(name):
+            return Result(False, NAME_ERROR)
+        record = Record(Name(name))
+        for phone in as_list(request.get('phones')):
+            if not record.create_phone(record, phone):
+                return Result(False, PHONE_ERROR)
+        email = request.get('email')
+        if email and not record.create_email(record, email):
+            return Result(False, EMAIL_ERROR)
+        birthday = request.get('birthday')
+        if birthday and not record.create_birthday(record, birthday):
+            return Result(False, BIRTHDAY_ERROR)
+        self.address_book.add_record(record)
+        return Result(message=f'Contact {name} added.',
+                      records=[(name, record)])
+
+    def do_find(self, request):
+        query = self.text(request, 'query') or ''
+        found = self.address_book.find_records(
+            query, int(request.get('start', 0)),
+            int(request['limit']) if request.get('limit') else None)
+        if not found:
+            return Result(message='Contact with this name or phone number '
+                                  'was not found.')
+        return Result(records=found)
+
+    def do_match(self, request):
+        prefix = self.text(request, 'name') or ''
+        return Result(records=self.address_book.match_names(prefix))
+
+    def do_show(self, request):
+        if any(request.get(field) for field in ('name', 'phones', 'email',
+                                                'birthday')):
+            return self.show_matching(request)
+        sort_by = request.get('sort')
+        args = request.get('args') or []
+        if len(args) == 2 and args[0] == 'by':
+            sort_by = args[1]
+        page, token = self.address_book.page(
+            int(request.get('limit', PAGE_SIZE)), request.get('token'),
+            sort_by)
+        if not page and not request.get('token'):
+            return Result(message='The address book is empty.')
+        return Result(records=page, token=token)
+
+    def show_matching(self, request):
+        # show with field filters, e.g. 'show all email=gmail.com'.
+        import executor
+
+        workers = request.get('workers')
+        found = self.address_book.scan(
+            executor.RowFilter.from_request(request), executor.render_row,
+            None if workers is None else int(workers))
+        if not found:
+            return Result(message='No contacts match.')
+        result = Result(records=[(name, self.address_book[name])
+                                 for name, line in found],
+                        message=f'{len(found)} contacts match.')
+        result.lines = [line for name, line in found]
+        return result
+
+    def do_report(self, request):
+        field = request.get('missing')
+        if field:
+            found = self.address_book.missing_contacts(field)
+            return Result(message=f'{len(found)} contacts have no {field}.',
+                          records=found)
+        days = request.get('days') or (request.get('args') or [None])[0]
+        import calendar
+
+        summary = self.address_book.summary(
+            days=None if days is None else int(days))
+        missing = summary['missing']
+        lines = [f"Contacts: {summary['contacts']}",
+                 f"Missing phone: {missing['phone']}, "
+                 f"email: {missing['email']}, "
+                 f"birthday: {missing['birthday']}",
+                 'Ages: ' + ', '.join(f'{label}: {count}' for label, count
+                                      in summary['ages'].items()),
+                 'Birthdays by month: ' + ', '.join(
+                     f'{calendar.month_abbr[i]} {count}'
+                     for i, count in enumerate(summary['birthday_months'],
+                                               1))]
+        if 'upcoming' in summary:
+            lines.append(f"Birthdays in the next {days} days: "
+                         f"{summary['upcoming']}")
+        return Result(message='\n'.join(lines), data=summary)
+
+    def do_birthdays(self, request):
+        days = int(self.text(request, 'days'))
+        found = self.address_book.upcoming_birthdays(days)
+        if not found:
+            return Result(message='There are no birthdays in this range!')
+        return Result(records=[(name, record) for day, name, record in found],
+                      data={'dates': [day.isoformat()
+                                      for day, name, record in found]})
+
+    def do_change(self, request):
+        name = self.target(request)
+        # Changes go to a copy, so a refused update leaves the contact as is.
+        record = self.address_book[name].copy()
+        messages = []
+        for phone in as_list(request.get('add_phone')):
+            if not record.create_phone(record, phone, update=False):
+                return Result(False, PHONE_ERROR)
+            messages.append(f'In contact {name} append '
+                            f'{[phone.value for phone in record.phones]}')
+        if 'phones' in request:
+            phones = as_list(request['phones'])
+            if not all(validators.validate_phones(phones)):
+                return Result(False, PHONE_ERROR)
+            record.phones = [Phone(phone) for phone in phones]
+            messages.append(f'In contact {name} update '
+                            f'{[phone.value for phone in record.phones]}')
+        if request.get('email'):
+            if not record.create_email(record, request['email']):
+                return Result(False, EMAIL_ERROR)
+            messages.append(f'In contact {name} change or append email '
+                            f'{record.email.value}')
+        if request.get('birthday'):
+            if not record.create_birthday(record, request['birthday']):
+                return Result(False, BIRTHDAY_ERROR)
+            messages.append(f'In contact {name} change or append date '
+                            f'birthday {record.birthday.value}')
+        new_name = request.get('rename')
+        if new_name and new_name != name:
+            if not validators.is_name(new_name):
+                return Result(False, NAME_ERROR)
+            if new_name in self.address_book:
+                return Result(False, f'Contact {new_name} already exists.')
+            record.name = Name(new_name)
+            self.address_book.rename_record(name, new_name, record)
+            messages.append(f'Contact {name} renamed to {new_name}')
+            name = new_name
+        else:
+            self.address_book.update_record(name, record)
+        return Result(message='\n'.join(messages), records=[(name, record)])
+
+    def do_who(self, request):
+        value = self.text(request, 'value') or ''
+        if '@' in value:
+            found = self.address_book.find_by_email(value)
+        else:
+            found = self.address_book.find_by_phone(value)
+        if not found:
+            return Result(message=f'Nobody has {value}.')
+        return Result(records=found)
+
+    def do_merge(self, request):
+        groups = self.address_book.duplicate_groups()
+        if not groups:
+            return Result(message='There are no duplicate contacts.')
+        if request.get('dry'):
+            return Result(message='\n'.join(
+                'Duplicates: ' + ', '.join(names) for names in groups),
+                data={'groups': groups})
+        messages = []
+        records = []
+        for keep, *others in groups:
+            record = self.address_book[keep].copy()
+            for other in others:
+                record.merge(self.address_book.remove_record(other))
+            self.address_book.update_record(keep, record)
+            records.append((keep, record))
+            messages.append(f'Merged {", ".join(others)} into {keep}.')
+        return Result(message='\n'.join(messages), records=records,
+                      data={'groups': groups})
+
+    def do_delete(self, request):
+        name = self.target(request)
+        if name not in self.address_book:
+            return Result(False, f'Contact {name} was not found.')
+        self.address_book.remove_record(name)
+        return Result(message=f'Contact {name} deleted.')
+
+    def do_clear(self, request):
+        self.address_book.clear_records()
+        message = 'The Address Book is cleared.'
+        if self.address_book_has('undo'):
+            message += " Use 'undo' to bring the contacts back."
+        return Result(message=message)
+
+    def address_book_has(self, feature):
+        return hasattr(self.address_book, feature)
+
+    def no_history(self):
+        return Result(False, 'Undo and snapshots are not available '
+                             'with this backend.')
+
+    def do_undo(self, request):
+        if not self.address_book_has('undo'):
+            return self.no_history()
+        if not self.address_book.undo():
+            return Result(False, 'Nothing to undo.')
+        return Result(message='Last change undone.')
+
+    def do_redo(self, request):
+        if not self.address_book_has('redo'):
+            return self.no_history()
+        if not self.address_book.redo():
+            return Result(False, 'Nothing to redo.')
+        return Result(message='Change redone.')
+
+    def do_snapshot(self, request):
+        if not self.address_book_has('take_snapshot'):
+            return self.no_history()
+        label = self.text(request, 'name')
+        if not label:
+            labels = sorted(self.address_book.snapshots)
+            return Result(message='Snapshots: ' + (', '.join(labels)
+                                                   or 'none'),
+                          data={'snapshots': labels})
+        self.address_book.take_snapshot(label)
+        return Result(message=f'Snapshot {label} taken.')
+
+    def do_restore(self, request):
+        if not self.address_book_has('restore_snapshot'):
+            return self.no_history()
+        label = self.text(request, 'name')
+        self.address_book.restore_snapshot(label)
+        return Result(message=f'Restored snapshot {label}.')
+
+    def do_import(self, request):
+        import transfer
+
+        file_name = self.text(request, 'file')
+        rejected_name = request.get('rejected') or file_name + \
+            '.rejected' + ('.csv' if transfer.is_csv(file_name) else '.jsonl')
+        try:
+            imported, rejected = transfer.import_rows(
+                self.address_book, file_name, Record.from_row, rejected_name,
+                int(request.get('workers') or 0))
+        except OSError as error:
+            return Result(False, f'Import failed: {error}')
+        message = f'Imported {imported} contacts.'
+        if rejected:
+            message += f'\n{rejected} rows were rejected, see {rejected_name}'
+        return Result(message=message, data={'imported': imported,
+                                             'rejected': rejected})
+
+    def do_export(self, request):
+        import transfer
+
+        file_name = self.text(request, 'file')
+        try:
+            count = transfer.export_rows(self.address_book, file_name)
+        except OSError as error:
+            return Result(False, f'Export failed: {error}')
+        return Result(message=f'Exported {count} contacts to {file_name}')
+
+
+def record_line(name, record):
+    return f"Name: {name}, {record.display_line()}"
+
+
+def report(result, framed=False):
+    # One write per page instead of a print() per record.
+    lines = result.lines or [record_line(name, record)
+                             for name, record in result.records]
+    if framed:
+        lines = [f'|{line}|' for line in lines]
+    if result.message:
+        lines.append(result.message)
+    if result.data.get('saved'):
+        lines.append('Your contact saved!')
+    if lines:
+        sys.stdout.write('\n'.join(lines) + '\n')
+
+
+def ask(prompt, check, error):
+    value = input(prompt)
+    for i in range(10):
+        if not value or check(value):
+            return value
+        print(error)
+        value = input(prompt)
+    return None
+
+
+def run_batch(engine, lines, as_json=False):
+    """Run one command per line, then save the book."""
+    failed = 0
+    try:
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.lower() in USER_EXIT_LIST:
+                break
+            try:
+                request = json.loads(line) if line.startswith('{') else line
+            except ValueError as error:
+                result = Result(False, f'Invalid request: {error}')
+            else:
+                result = engine.execute(request)
+            failed += not result.ok
+            # Batches save once at the end, unless --flush-interval asks
+            # for changes to be saved sooner.
+            if engine.flush_due():
+                engine.save()
+            if as_json:
+                print(json.dumps(result.to_dict(), ensure_ascii=False))
+            else:
+                report(result)
+    finally:
+        engine.save()
+    conflicts = engine.conflict_message()
+    if conflicts:
+        print(conflicts, file=sys.stderr)
+        failed += 1
+    return failed
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Address Book')
+    parser.add_argument('--backend', choices=['journal', 'sharded', 'sqlite'],
+                        default='journal',
+                        help='where contacts are kept (default: journal)')
+    parser.add_argument('--shards', type=int, default=8,
+                        help='files a new sharded book is split into')
+    parser.add_argument('--workers', type=int,
+                        help='processes used to validate imported rows and '
+                             'to scan large books (default: one per CPU '
+                             'for scans, none for imports)')
+    parser.add_argument('--flush-every', type=int, default=1,
+                        help='save after this many changes (default: 1)')
+    parser.add_argument('--flush-interval', type=float,
+                        help='also save once the oldest unsaved change is '
+                             'this many seconds old')
+    parser.add_argument('--unique', action='store_true',
+                        help='refuse a phone number or email that another '
+                             'contact already has')
+    parser.add_argument('--history', type=int, default=100,
+                        help='changes that can be undone (default: 100)')
+    parser.add_argument('--metrics', action='store_true',
+                        help="time operations; see them with 'stats'")
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write a cProfile dump of the session to FILE')
+    parser.add_argument('--batch', metavar='FILE',
+                        help="run the commands in FILE ('-' for stdin) "
+                             "without prompts and save at the end")
+    parser.add_argument('--json', action='store_true',
+                        help='print batch results as JSON lines')
+    args = parser.parse_args(argv)
+    metrics.enable(args.metrics)
+    if not args.profile:
+        return start(args)
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(start, args)
+    finally:
+        profiler.dump_stats(args.profile)
+
+
+def start(args):
+    if args.backend == 'sqlite':
+        from sqlite_book import SQLiteAddressBook
+        address_book = SQLiteAddressBook(record_type=Record,
+                                         unique=args.unique)
+    else:
+        storage = None
+        if args.backend == 'sharded':
+            storage = ShardedStorage(AddressBook.file_name, args.shards,
+                                     record_type=Record)
+        address_book = AddressBook(storage=storage,
+                                   flush_every=args.flush_every,
+                                   flush_interval=args.flush_interval,
+                                   unique=args.unique, history=args.history)
+    try:
+        address_book.load_contacts()
+    except PickledBookError as error:
+        print(error, file=sys.stderr)
+        return 1
+    if args.batch:
+        engine = CommandEngine(address_book)
+        if args.batch == '-':
+            failed = run_batch(engine, sys.stdin, args.json)
+        else:
+            with open(args.batch, encoding='utf-8') as f:
+                failed = run_batch(engine, f, args.json)
+        return 1 if failed else 0
+
+    engine = CommandEngine(address_book, autosave=True, refresh=True)
+    # colorama is only needed for the menu, not for batch runs.
+    from colorama import Fore
+
     print(Fore.LIGHTBLUE_EX + '-' * 52)
     print('|You can use following commands:\n'
           '|add - Add new contact\n'
           '|find - Find contact in Address Book\n'
+          '|who - Find the owner of a phone number or email\n'
+          '|merge - Merge contacts sharing a phone number or email\n'
           '|show all - Shows the entire Address Book\n'
+          '|show all by name, show all by birthday - Sorted Address Book\n'
+          '|show all email=gmail name=ann - Contacts whose fields contain '
+          'the texts\n'
           '|get bith - Show birthdays\n'
+          '|report, report 30, report missing=email - Ages, birthdays and '
+          'gaps\n'
           '|change - Change contact\n'
           '|del - Delete contact from address book\n'
+          '|undo, redo - Take back the last change or do it again\n'
+          '|snapshot, restore - Name the current state or go back to it\n'
+          '|import, export - Load or save contacts as CSV or JSON Lines\n'
+          '|stats - Timings of this session (with --metrics)\n'
           '|close, exit, good bye or . - Closing the program\n')
     print('-' * 52)
+    try:
+        repl(engine, args)
+    finally:
+        engine.save()
+        conflicts = engine.conflict_message()
+        if conflicts:
+            print(conflicts)
+
+
+def repl(engine, args):
     while True:
         user_inp = input('Enter command: ').lower().strip()
-        user_exit_list = ['good bye', 'close', 'exit', '.']
-        if user_inp in user_exit_list:
+        if user_inp in USER_EXIT_LIST:
             print('Good bye!\n'
                   'Your data has been successfully saved in the Address Book!')
             break
         elif user_inp == 'hello':
-            print('How can I help you?')
+            report(engine.execute('hello'))
+            continue
+        elif user_inp in ('undo', 'redo', 'stats') or \
+                user_inp.startswith('report'):
+            report(engine.execute(user_inp))
             continue
+        elif user_inp.startswith('show all'):
+            # Before the substring checks: filter texts such as
+            # name=maddie must not pick another command.
+            show_all_contacts(engine, user_inp, args.workers)
+        elif 'snapshot' in user_inp or 'restore' in user_inp:
+            snapshot_contacts(engine, user_inp)
+        elif 'import' in user_inp:
+            import_contacts(engine, args.workers)
+        elif 'export' in user_inp:
+            export_contacts(engine)
         elif 'add' in user_inp:
-            add_contacts(address_book)
+            add_contacts(engine)
         elif 'find' in user_inp:
-            find_contacts(address_book)
-        elif 'show all' in user_inp:
-            show_all_contacts(address_book)
+            find_contacts(engine)
+        elif 'who' in user_inp:
+            who_contacts(engine)
+        elif 'merge' in user_inp:
+            merge_contacts(engine)
         elif 'get bith' in user_inp:
-            birthday_contacts(address_book)
+            birthday_contacts(engine)
         elif 'change' in user_inp:
-            change_contacts(address_book)
+            change_contacts(engine)
         elif 'del' in user_inp:
-            remove_contacts(address_book)
+            remove_contacts(engine)
         else:
             print('Choose the right command!')
             continue
 
 
-def add_contacts(address_book):
+def add_contacts(engine):
     user_name = input("Enter contact name: ")
     if not user_name:
         print("Contact name is required")
         return
-    else:
-        name = Name(user_name)
-    record = Record(name)
+    user_phone = ask("Enter contact phone: ", validators.is_phone,
+                     PHONE_ERROR)
+    user_email = ask("Enter contact email: ", validators.is_email,
+                     EMAIL_ERROR)
+    user_birthday = ask("Enter contact Birthday: ", validators.is_birthday,
+                        BIRTHDAY_ERROR)
+    result = engine.execute({'command': 'add', 'name': user_name,
+                             'phones': as_list(user_phone or None),
+                             'email': user_email,
+                             'birthday': user_birthday})
+    if result.data.get('saved'):
+        print('Your contact saved!')
+    elif not result.ok:
+        print(result.message)
+
+
+def show_all_contacts(engine, user_inp='', workers=None):
+    if '=' in user_inp:
+        request = parse_command(user_inp)
+        request['workers'] = workers
+        report(engine.execute(request), framed=True)
+        return
+    request = {'command': 'show'}
+    if user_inp.endswith('by name'):
+        request['sort'] = 'name'
+    elif user_inp.endswith('by birthday'):
+        request['sort'] = 'birthday'
+    while True:
+        result = engine.execute(request)
+        report(result, framed=True)
+        if not result.token:
+            break
+        more = input("Press Enter for the next page or 'q' to stop: ")
+        if more.lower().strip() == 'q':
+            break
+        request['token'] = result.token
 
-    user_phone = input("Enter contact phone: ")
-    record.create_phone(record=record, user_input=user_phone, update=True)
 
-    user_email = input("Enter contact email: ")
-    record.create_email(record=record, user_email=user_email)
+def find_contacts(engine):
+    find_user = input('Enter part of a name, email or phone: ')
+    request = {'command': 'find', 'query': find_user, 'limit': PAGE_SIZE}
+    while True:
+        result = engine.execute(request)
+        if request.get('start') and not result.records:
+            break
+        report(result)
+        if len(result.records) < PAGE_SIZE:
+            break
+        more = input("Press Enter for the next page or 'q' to stop: ")
+        if more.lower().strip() == 'q':
+            break
+        request['start'] = request.get('start', 0) + PAGE_SIZE
+
 
-    user_birthday = input("Enter contact Birthday: ")
-    record.create_birthday(record=record, user_birthday=user_birthday)
-    address_book.add_record(record)
-    address_book.save_contacts()
+def who_contacts(engine):
+    value = input('Enter a phone number or email: ')
+    report(engine.execute({'command': 'who', 'value': value}))
 
 
-def show_all_contacts(address_book):
-    data = address_book.show_all_records()
-    if not data:
-        print('The address book is empty.')
-    else:
-        for name, record in data.items():
-            rec_data = record.formatting_record(record)
-            print(f"|Name: {name}, Phone: {rec_data['phone']}, "
-                  f"Email: {rec_data['email']}, "
-                  f"Birthday: {rec_data['birthday']}|")
-
-def find_contacts(address_book):
-    find_user = input('Enter contact name or phone: ')
-    data = address_book.show_all_records()
-    if not data:
-        print('The address book is empty.')
-    else:
-        flag = False
-        for name, record in data.items():
-            rec_data = record.formatting_record(record)
-            if name.startswith(find_user):
-                flag = True
-                print(f"Name: {name}, Phone: {rec_data['phone']}, "
-                      f"Email: {rec_data['email']}, "
-                      f"Birthday: {rec_data['birthday']}")
-            phone = getattr(record, 'phone', '')
-            if phone:
-                if phone.value.startswith(find_user):
-                    flag = True
-                    print(f"Name: {name}, Phone: {rec_data['phone']}, "
-                          f"Email: {rec_data['email']}, "
-                          f"Birthday: {rec_data['birthday']}")
-        if not flag:
-            print('Contact with this name or phone number was not found.')
+def merge_contacts(engine):
+    result = engine.execute({'command': 'merge', 'dry': True})
+    print(result.message)
+    if not result.data.get('groups'):
+        return
+    if input('Merge them? Y or N: ').lower().strip() == 'y':
+        report(engine.execute({'command': 'merge'}))
 
 
-def birthday_contacts(address_book):
+def birthday_contacts(engine):
     birth_user = int(input('Enter a number of days: '))
-    flag = False
-    now = datetime.now().date()
-    data = address_book.show_all_records()
-    current_date = now + timedelta(days=birth_user)
-    for name, record in data.items():
-        rec_data = record.formatting_record(record)
-        if record.birthday:
-            birth = rec_data['birthday']
-            new_user_date = datetime.strptime(birth, "%d.%m.%Y").date()
-            new_date = datetime(day=new_user_date.day,
-                                month=new_user_date.month, 
-                                year=now.year).date()
-            if new_date >= now and new_date < current_date:
-                flag = True
-                print(f"Name: {name}, Phone: {rec_data['phone']}, "
-                      f"Email: {rec_data['email']}, "
-                      f"Birthday: {rec_data['birthday']}")
-    if not flag:
-        print('There are no birthdays in this range!')
-
-
-def change_contacts(address_book):
+    report(engine.execute({'command': 'birthdays', 'days': birth_user}))
+
+
+def change_contacts(engine):
     change_user = input('Enter contact name: ')
-    data = address_book.show_all_records()
-    if not data:
-        print('The address book is empty.')
+    if change_user in engine.address_book:
+        name = change_user
     else:
-        flag = False
-        for name, record in data.items():
-            rec_data = record.formatting_record(record)
-            if name.startswith(change_user):
-                flag = True
-                print("-"*50)
-                print(f"|add phone - press 1|\n"
-                      f"|change email - press 2|\n"
-                      f"|change birthday - press 3|\n"
-                      f"|change name - press 4\n"
-                      f"|change phone number - press 5")
-                print("-" * 50)
-                change = int(input('Enter your choice: '))
-                if change == 1:
-                    num = input('Enter number: ')
-                    record.create_phone(record=record, user_input=num,
-                                        update=False)
-                    print(f'In contact {name} append '
-                          f'{[phone.value for phone in record.phones]}')
-                elif change == 2:
-                    mail = input('Enter new email: ')
-                    record.create_email(record=record, user_email=mail)
-                    print(f'In contact {name} change or append email '
-                          f'{record.email.value}')
-                elif change == 3:
-                    birthday = input('Enter new date: ')
-                    record.create_birthday(record=record, user_birthday=birthday)
-                    print(f'In contact {name} change or append date birthday '
-                          f'{record.birthday.value}')
-                elif change == 4:
-                    new_name = input('Enter new name: ')
-                    record.name = Name(new_name)
-                elif change == 5:
-                    num = input('Enter number: ')
-                    record.create_phone(record=record, user_input=num,
-                                        update=True)
-                    print(f'In contact {name} update '
-                          f'{[phone.value for phone in record.phones]}')
-                else:
-                    print(f'{change} invalid choice')
-                    return
-        address_book.save_contacts()
+        # A prefix only picks the contact when it is unambiguous.
+        matches = engine.execute({'command': 'match', 'name': change_user})
+        if len(matches.records) != 1:
+            print(f'Contact {change_user} was not found.' if not
+                  matches.records else 'Which one? ' + ', '.join(
+                      name for name, record in matches.records))
+            return
+        name = matches.records[0][0]
+    print("-"*50)
+    print(f"|add phone - press 1|\n"
+          f"|change email - press 2|\n"
+          f"|change birthday - press 3|\n"
+          f"|change name - press 4\n"
+          f"|change phone number - press 5")
+    print("-" * 50)
+    change = int(input('Enter your choice: '))
+    if change == 1:
+        field, value = 'add_phone', ask('Enter number: ', validators.is_phone,
+                                        PHONE_ERROR)
+    elif change == 2:
+        field, value = 'email', ask('Enter new email: ', validators.is_email,
+                                    EMAIL_ERROR)
+    elif change == 3:
+        field, value = 'birthday', ask('Enter new date: ',
+                                       validators.is_birthday, BIRTHDAY_ERROR)
+    elif change == 4:
+        field, value = 'rename', input('Enter new name: ')
+    elif change == 5:
+        field, value = 'phones', ask('Enter number: ', validators.is_phone,
+                                     PHONE_ERROR)
+    else:
+        print(f'{change} invalid choice')
+        return
+    if value is None:
+        # ask() gave up after too many invalid entries.
+        print(f'Contact {name} was not changed.')
+        return
+    if field == 'phones':
+        value = as_list(value)
+    result = engine.execute({'command': 'change', 'name': name,
+                             field: value})
+    print(result.message)
+    if result.data.get('saved'):
+        print('Your contact saved!')
 
 
-def remove_contacts(address_book):
+def snapshot_contacts(engine, user_inp):
+    command = 'restore' if 'restore' in user_inp else 'snapshot'
+    report(engine.execute({'command': 'snapshot'}))
+    label = input('Enter snapshot name: ').strip()
+    if label:
+        report(engine.execute({'command': command, 'name': label}))
+
+
+def import_contacts(engine, workers=0):
+    file_name = input('Enter the .csv or .jsonl file to import: ').strip()
+    rejected_name = input('Enter the file for rejected rows '
+                          '(Enter for the default): ').strip()
+    result = engine.execute({'command': 'import', 'file': file_name,
+                             'rejected': rejected_name, 'workers': workers})
+    report(result)
+
+
+def export_contacts(engine):
+    file_name = input('Enter the .csv or .jsonl file to export to: ').strip()
+    report(engine.execute({'command': 'export', 'file': file_name}))
+
+
+def remove_contacts(engine):
     print('|del - Delete user|\n'
           '|del all - Clean Adress Book|')
     remove_date = input('Enter your choice: ')
     if remove_date == 'del':
         remove_user = input('Enter the name of the contact to be deleted: ')
-        address_book.data.pop(remove_user)
-        print(f'Contact {remove_user} deleted.')
+        report(engine.execute({'command': 'delete', 'name': remove_user}))
     elif remove_date == 'del all':
         print(f'Are you sure you want to clear the Address Book?')
         question = input('Y or N: ').lower().strip()
@@ -360,10 +1694,8 @@ def remove_contacts(address_book):
             return
         elif question == 'y':
             print('lol')
-            address_book.data.clear()
-    address_book.save_contacts()
+            report(engine.execute({'command': 'clear'}))
 
 
 if __name__ == "__main__":
-    main()
-
+    sys.exit(main())
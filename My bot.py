@@ -3,6 +3,7 @@ from collections import UserDict
 from datetime import datetime, timedelta
 import re
 from colorama import init, Fore
+from indexes import next_birthday
 
 class AddressBook(UserDict):
     file_name = 'AddressBook.bin'
@@ -72,15 +73,8 @@ class Record:
         if self.birthday:
             now = datetime.now().date()
             bday2 = self.birthday.value.split('.')
-            b = datetime(year=now.year, month=int(bday2[1]),day=int(bday2[0])).date()
-            next = b - now
-            if next.days < 0:
-                b = datetime(year=now.year + 1, month=int(bday2[1]),
-                             day=int(bday2[0])).date()
-                print(b - now)
-            else:
-                next = b - now
-                print(next)
+            b = next_birthday(int(bday2[1]), int(bday2[0]), now)
+            print(b - now)
 
 
 class Field:
@@ -0,0 +1,230 @@
+"""Benchmarks for the AddressBook hot paths on synthetic books.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_addressbook --sizes 1000,10000,100000
+    python -m benchmarks.bench_addressbook --save-baseline \
+        benchmarks/baseline.json
+    python -m benchmarks.bench_addressbook --baseline benchmarks/baseline.json
+
+Every operation is timed without any input() prompts. The report is JSON
+with throughput, latency percentiles and peak traced memory for each
+operation and book size. With --baseline the run is compared against a
+stored report and the exit status is 1 if an operation got slower than
+the tolerance allows; --save-baseline writes the current run as the new
+baseline. Baselines are local and not committed. Each run also times a
+fixed plain-Python reference workload, and baseline times are scaled by
+the ratio of the two reference times before comparing, so a baseline
+saved on a faster or slower machine still gives a usable gate. Times
+bound by disk rather than CPU scale less well.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from AddressBook import AddressBook, Birthday, Email, Name, Phone, Record
+from storage import JournalStorage
+
+FIRST_NAMES = ['Anna', 'Bohdan', 'Daria', 'Ivan', 'Kateryna', 'Maksym',
+               'Olena', 'Petro', 'Sofiia', 'Taras', 'Yulia', 'Zakhar']
+
+
+def make_record(rnd, i):
+    name = f'{rnd.choice(FIRST_NAMES)} {i:07d}'
+    record = Record(Name(name))
+    for _ in range(rnd.randint(1, 2)):
+        record.add_phone(Phone(f'+380{rnd.choice("5679")}'
+                               f'{rnd.randrange(10 ** 8):08d}'))
+    if rnd.random() < 0.7:
+        record.email = Email(f'user{i}@example.com')
+    if rnd.random() < 0.8:
+        record.birthday = Birthday(f'{rnd.randint(1, 28):02d}.'
+                                   f'{rnd.randint(1, 12):02d}.'
+                                   f'{rnd.randint(1950, 2010)}')
+    return record
+
+
+def make_book(directory, size, seed=1):
+    rnd = random.Random(seed)
+    storage = JournalStorage(os.path.join(directory, 'AddressBook.bin'),
+                             record_type=Record)
+    book = AddressBook(storage=storage)
+    book.add_records([make_record(rnd, i) for i in range(size)])
+    return book
+
+
+def open_book(directory):
+    book = AddressBook(
+        storage=JournalStorage(os.path.join(directory, 'AddressBook.bin'),
+                               record_type=Record))
+    book.load_contacts()
+    return book
+
+
+def reference_workload():
+    # Dicts, sorting and string work, like the operations measured.
+    rnd = random.Random(0)
+    names = [f'{rnd.choice(FIRST_NAMES)} {rnd.randrange(10 ** 7):07d}'
+             for _ in range(20000)]
+    index = {name: i for i, name in enumerate(sorted(names))}
+    return json.dumps(index)
+
+
+def timed_ms(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1e3
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def measure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    total = sum(samples)
+    return {
+        'runs': repeat,
+        'ops_per_sec': repeat / total if total else None,
+        'p50_ms': percentile(samples, 50) * 1e3,
+        'p95_ms': percentile(samples, 95) * 1e3,
+        'p99_ms': percentile(samples, 99) * 1e3,
+        'peak_kib': peak / 1024,
+    }
+
+
+def run_size(size, repeat, seed=1):
+    results = {}
+    rnd = random.Random(seed + 1)
+    with tempfile.TemporaryDirectory() as directory:
+        book = make_book(directory, size, seed)
+        names = list(book.data)
+        results['save_contacts.full'] = measure(
+            lambda: book.storage.compact(book.data), max(1, repeat // 10))
+        book = open_book(directory)
+
+        def save_one():
+            name = rnd.choice(names)
+            record = book[name]
+            book.update_record(name, record)
+            book.save_contacts()
+
+        results['save_contacts.one_edit'] = measure(save_one, repeat)
+        results['load_contacts'] = measure(lambda: open_book(directory),
+                                           max(1, repeat // 10))
+
+        book = open_book(directory)
+        results['find_contacts.first'] = measure(
+            lambda: book.find_records(rnd.choice(names)[:6]), 1)
+        results['find_contacts'] = measure(
+            lambda: book.find_records(rnd.choice(names)[:8], limit=20),
+            repeat)
+        results['find_contacts.phone'] = measure(
+            lambda: book.find_records(f'+3809{rnd.randrange(1000):03d}',
+                                      limit=20), repeat)
+        results['birthday_contacts'] = measure(
+            lambda: book.upcoming_birthdays(7), repeat)
+        results['iterate'] = measure(
+            lambda: sum(1 for _ in book.iterate(20)), max(1, repeat // 10))
+
+        def page_all():
+            page, token = book.page(20)
+            while token is not None:
+                page, token = book.page(20, token)
+
+        results['page'] = measure(page_all, max(1, repeat // 10))
+
+        def format_all():
+            for name, record in book.data.items():
+                record.formatting_record(record)
+
+        results['formatting_record'] = measure(format_all,
+                                               max(1, repeat // 10))
+    return results
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    # How much slower this machine is than the baseline's, if it says.
+    scale = report['reference_ms'] / baseline['reference_ms'] \
+        if baseline.get('reference_ms') else 1.0
+    report['machine_scale'] = scale
+    report['not_in_baseline'] = []
+    for size, operations in report['sizes'].items():
+        for operation, result in operations.items():
+            old = baseline.get('sizes', {}).get(size, {}).get(operation)
+            if not old:
+                report['not_in_baseline'].append(f'{operation} @ {size}')
+                continue
+            change = result['p50_ms'] / (old['p50_ms'] * scale) - 1 \
+                if old['p50_ms'] else 0.0
+            result['p50_change'] = change
+            if change > tolerance:
+                regressions.append(f'{operation} @ {size}: p50 '
+                                   f'{old["p50_ms"] * scale:.3f} -> '
+                                   f'{result["p50_ms"]:.3f} ms '
+                                   f'(+{change:.0%})')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated book sizes')
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='runs of each per-call operation')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='compare against this report')
+    parser.add_argument('--save-baseline',
+                        help='write this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p50 slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    report = {'python': sys.version.split()[0], 'sizes': {}}
+    # Timed before and after the operations, so a burst of load on the
+    # machine moves the reference less.
+    reference = [timed_ms(reference_workload) for _ in range(10)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for size in (int(size) for size in args.sizes.split(',')):
+            report['sizes'][str(size)] = run_size(size, args.repeat)
+    reference += [timed_ms(reference_workload) for _ in range(10)]
+    report['reference_ms'] = percentile(reference, 50)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text + '\n')
+    for line in regressions:
+        print(f'REGRESSION {line}', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
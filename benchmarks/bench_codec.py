@@ -0,0 +1,112 @@
+"""Save time, load time and file size of pickle against the codec rows.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_codec --size 100000
+
+Three formats are compared on one synthetic book: the whole-dict pickle
+AddressBook.bin used to be, a codec row stream, and the mapped snapshot
+with pickled and with row-encoded blobs. Loads decode every record.
+"""
+import argparse
+import json
+import os
+import pickle
+import random
+import tempfile
+import time
+
+import codec
+from AddressBook import Record
+from benchmarks.bench_addressbook import make_record
+from storage import JournalStorage
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def pickle_file(path, records):
+    def save():
+        with open(path, 'wb') as f:
+            pickle.dump(records, f, pickle.HIGHEST_PROTOCOL)
+
+    def load():
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    return save, load
+
+
+def stream_file(path, records):
+    def save():
+        with open(path, 'wb') as f:
+            encoder = codec.RowEncoder(f)
+            for record in records.values():
+                encoder.write(record.to_row())
+
+    def load():
+        with open(path, 'rb') as f:
+            return {row[0]: Record.from_row(row)
+                    for row in codec.iter_rows(f)}
+
+    return save, load
+
+
+def snapshot_file(path, records, record_type):
+    def save():
+        storage = JournalStorage(path, record_type=record_type)
+        storage.compact(records)
+        storage.close()
+
+    def load():
+        # A row-format storage refuses pickled snapshots.
+        storage = JournalStorage(path, record_type=record_type)
+        data = storage.load()
+        loaded = {name: data[name] for name in data}
+        storage.close()
+        return loaded
+
+    return save, load
+
+
+def run(size, seed=1):
+    rnd = random.Random(seed)
+    records = {}
+    for i in range(size):
+        record = make_record(rnd, i)
+        records[record.name.value] = record
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {name: os.path.join(directory, name)
+                 for name in ('pickle', 'rows', 'snapshot.pickle',
+                              'snapshot.rows')}
+        formats = {
+            'pickle': pickle_file(paths['pickle'], records),
+            'rows': stream_file(paths['rows'], records),
+            'snapshot.pickle': snapshot_file(paths['snapshot.pickle'],
+                                             records, None),
+            'snapshot.rows': snapshot_file(paths['snapshot.rows'], records,
+                                           Record),
+        }
+        for name, (save, load) in formats.items():
+            save_seconds, _ = timed(save)
+            load_seconds, loaded = timed(load)
+            assert len(loaded) == size
+            report[name] = {'save_sec': save_seconds,
+                            'load_sec': load_seconds,
+                            'bytes': os.path.getsize(paths[name])}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=100000)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.size), indent=2))
+
+
+if __name__ == '__main__':
+    main()
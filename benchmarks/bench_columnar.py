@@ -0,0 +1,90 @@
+"""Whole-book reports with a Python loop against the NumPy columns.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_columnar --size 100000
+
+On one synthetic book this times the 'report' summary computed by
+columnar.summarize over every record and by ColumnarIndex.summary, the
+cost of building the columns and of keeping them current through edits,
+and a 30-day birthday count with BirthdayIndex.days_to_birthday per
+record, the birthday buckets and the columns. Every pair of answers is
+checked to agree.
+"""
+import argparse
+import json
+import random
+from datetime import date
+
+import columnar
+from AddressBook import record_columns
+from benchmarks.bench_addressbook import make_record
+from benchmarks.bench_codec import timed
+from indexes import BirthdayIndex
+
+TODAY = date(2024, 2, 20)
+DAYS = 30
+
+
+def run(size, seed=1, edits=1000):
+    rnd = random.Random(seed)
+    records = {}
+    for i in range(size):
+        record = make_record(rnd, i)
+        records[record.name.value] = record
+
+    def loop_summary():
+        return columnar.summarize(
+            ((name, *record_columns(record))
+             for name, record in records.items()), TODAY, DAYS)
+
+    def build():
+        index = columnar.ColumnarIndex(record_columns)
+        index.rebuild(records)
+        return index
+
+    report = {}
+    report['loop_summary_sec'], expected = timed(loop_summary)
+    report['build_sec'], index = timed(build)
+    report['columnar_summary_sec'], found = timed(
+        lambda: index.summary(TODAY, DAYS))
+    assert found == expected, (found, expected)
+
+    names = rnd.sample(list(records), min(edits, size))
+
+    def edit():
+        for name in names:
+            index.discard(name)
+            index.add(name, records[name])
+
+    report['edits'] = len(names)
+    report['edit_sec'], _ = timed(edit)
+    assert index.summary(TODAY, DAYS) == expected
+
+    birthdays = BirthdayIndex(
+        lambda record: record.birthday.month_day if record.birthday
+        else None)
+    birthdays.rebuild(records)
+
+    def loop_upcoming():
+        days = (birthdays.days_to_birthday(name, TODAY) for name in records)
+        return sum(1 for until in days if until is not None and until < DAYS)
+    report['loop_upcoming_sec'], expected = timed(loop_upcoming)
+    report['bucket_upcoming_sec'], found = timed(
+        lambda: len(birthdays.upcoming(TODAY, DAYS)))
+    assert found == expected
+    report['columnar_upcoming_sec'], found = timed(
+        lambda: index.summary(TODAY, DAYS)['upcoming'])
+    assert found == expected
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=100000)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.size), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Cold-start time of one-shot AddressBook.py runs against a target.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --size 100000
+
+A synthetic book is saved once. Then each command runs in a fresh
+'python AddressBook.py --batch -' process, the way a script would call
+it, and the median wall time of --repeat runs is reported. The exit
+status is 1 when a command takes longer than its target; TARGETS holds
+the targets for a 100000-contact book.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_addressbook import make_book
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'AddressBook.py')
+# Seconds; a bare interpreter start is about 0.02 of them.
+TARGETS = {
+    'import': 0.15,
+    'hello': 0.25,
+    'show': 0.25,
+    'birthdays 7': 1.0,
+}
+
+
+def cold_run(directory, command):
+    if command == 'import':
+        args = [sys.executable, '-c', 'import AddressBook']
+        stdin = b''
+    else:
+        args = [sys.executable, SCRIPT, '--batch', '-']
+        stdin = command.encode()
+    env = dict(os.environ,
+               PYTHONPATH=os.path.dirname(SCRIPT) + os.pathsep +
+               os.environ.get('PYTHONPATH', ''))
+    start = time.perf_counter()
+    subprocess.run(args, input=stdin, cwd=directory, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run(size, repeat):
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            make_book(directory, size).save_contacts()
+        for command, target in TARGETS.items():
+            seconds = statistics.median(cold_run(directory, command)
+                                        for _ in range(repeat))
+            report[command] = {'sec': seconds, 'target_sec': target}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    report = run(args.size, args.repeat)
+    print(json.dumps(report, indent=2))
+    slow = [command for command, result in report.items()
+            if result['sec'] > result['target_sec']]
+    for command in slow:
+        print(f'REGRESSION {command!r} took {report[command]["sec"]:.3f}s, '
+              f'target {report[command]["target_sec"]}s', file=sys.stderr)
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
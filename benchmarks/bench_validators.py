@@ -0,0 +1,76 @@
+"""Per-value cost of the Phone, Email and Birthday validators.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_validators --count 100000
+"""
+import argparse
+import random
+import re
+import timeit
+from datetime import datetime
+
+import validators
+
+
+def legacy_phone(phone):
+    pattern = r"^[\+]?3?[\s]?8?[\s]?\(?0\d{2}?\)?" \
+              r"[\s]?\d{3}[\s|-]?\d{2}[\s|-]?\d{2}$"
+    return re.match(pattern, phone) is not None
+
+
+def legacy_email(email):
+    pattern = r"^[-\w\.]+@([-\w]+\.)+[-\w]{2,4}$"
+    return re.match(pattern, email) is not None
+
+
+def legacy_birthday(birthday):
+    try:
+        bt_obj = datetime.strptime(birthday, '%d.%m.%Y')
+        return bt_obj.date() < datetime.now().date()
+    except ValueError:
+        return False
+
+
+def sample(count, seed=1):
+    rnd = random.Random(seed)
+    phones = [f'+38099{rnd.randrange(10 ** 7):07d}' for _ in range(count)]
+    emails = [f'user{i}@example.com' for i in range(count)]
+    birthdays = [f'{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.'
+                 f'{rnd.randint(1950, 2010)}' for _ in range(count)]
+    return phones, emails, birthdays
+
+
+def per_value(func, values, repeat):
+    best = min(timeit.repeat(lambda: func(values), number=1, repeat=repeat))
+    return best / len(values) * 1e9
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    phones, emails, birthdays = sample(args.count)
+    cases = [
+        ('phone', phones, legacy_phone, validators.is_phone,
+         validators.validate_phones),
+        ('email', emails, legacy_email, validators.is_email,
+         validators.validate_emails),
+        ('birthday', birthdays, legacy_birthday, validators.is_birthday,
+         validators.validate_birthdays),
+    ]
+    print(f'{"field":<10}{"legacy ns":>12}{"single ns":>12}{"batch ns":>12}')
+    for name, values, legacy, single, batch in cases:
+        legacy_ns = per_value(lambda vs: [legacy(v) for v in vs], values,
+                              args.repeat)
+        single_ns = per_value(lambda vs: [single(v) for v in vs], values,
+                              args.repeat)
+        batch_ns = per_value(batch, values, args.repeat)
+        print(f'{name:<10}{legacy_ns:>12.0f}{single_ns:>12.0f}'
+              f'{batch_ns:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
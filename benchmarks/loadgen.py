@@ -0,0 +1,83 @@
+"""Load generator for server.py.
+
+Run from the repository root against a running server:
+
+    python -m benchmarks.loadgen --clients 50 --requests 200
+
+Each client opens its own connection and sends requests one at a time.
+A --write-ratio share of them adds contacts; the rest search by name
+prefix. The report gives requests per second and latency percentiles.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+async def client(number, args, latencies, errors):
+    if args.unix:
+        reader, writer = await asyncio.open_unix_connection(args.unix)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+    rnd = random.Random(number)
+    try:
+        for i in range(args.requests):
+            if rnd.random() < args.write_ratio:
+                request = {'command': 'add', 'name': f'load {number}-{i}',
+                           'phones': [f'+38099{rnd.randrange(10 ** 7):07d}']}
+            else:
+                request = {'command': 'find',
+                           'query': f'load {rnd.randrange(args.clients)}',
+                           'limit': 20}
+            request['id'] = i
+            start = time.perf_counter()
+            writer.write(json.dumps(request).encode() + b'\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if not response.get('ok'):
+                errors.append(response.get('message'))
+    finally:
+        writer.close()
+
+
+def percentile(samples, q):
+    return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+async def run(args):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(number, args, latencies, errors)
+                           for number in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'seconds': elapsed,
+        'requests_per_sec': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1e3,
+        'p95_ms': percentile(latencies, 95) * 1e3,
+        'p99_ms': percentile(latencies, 99) * 1e3,
+        'max_ms': latencies[-1] * 1e3,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=100,
+                        help='requests per client')
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    args = parser.parse_args(argv)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Compact binary encoding of contact rows.
+
+A row is (name, phones, email, birthday) as returned by Record.to_row.
+An encoded row is one version byte followed by the UTF-8 fields joined
+with FIELD_SEP, the phones themselves joined with PHONE_SEP; a missing
+email or birthday is an empty field. Decoding is a decode and two
+splits, so no classes are looked up or constructed as with pickle.
+
+A row stream is MAGIC, then each encoded row behind a 4-byte length.
+
+Convert a pickled book to the row format with
+
+    python codec.py AddressBook.bin
+"""
+import struct
+
+VERSION = 1
+MAGIC = b'ABRS'
+FIELD_SEP = '\x00'
+PHONE_SEP = '\x1e'
+LENGTH = struct.Struct('<I')
+
+
+def encode_row(row):
+    name, phones, email, birthday = row
+    fields = (name, PHONE_SEP.join(phones), email or '', birthday or '')
+    for field in fields:
+        if FIELD_SEP in field:
+            raise ValueError(f'{field!r} contains a NUL character')
+    for phone in phones:
+        if PHONE_SEP in phone:
+            raise ValueError(f'{phone!r} contains a separator character')
+    return bytes((VERSION,)) + FIELD_SEP.join(fields).encode()
+
+
+def decode_row(blob):
+    if not blob or blob[0] != VERSION:
+        raise ValueError('Unsupported row encoding')
+    name, phones, email, birthday = bytes(blob[1:]).decode() \
+        .split(FIELD_SEP)
+    return (name, tuple(phones.split(PHONE_SEP)) if phones else (),
+            email or None, birthday or None)
+
+
+class RowEncoder:
+    """Writes rows to a binary file one at a time."""
+
+    def __init__(self, file):
+        self.file = file
+        self.file.write(MAGIC)
+
+    def write(self, row):
+        blob = encode_row(row)
+        self.file.write(LENGTH.pack(len(blob)))
+        self.file.write(blob)
+
+
+def iter_rows(file):
+    """Decode the rows of a stream written by RowEncoder, one at a time."""
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a row stream')
+    while True:
+        head = file.read(LENGTH.size)
+        if not head:
+            return
+        if len(head) < LENGTH.size:
+            raise ValueError('Truncated row stream')
+        length, = LENGTH.unpack(head)
+        blob = file.read(length)
+        if len(blob) < length:
+            raise ValueError('Truncated row stream')
+        yield decode_row(blob)
+
+
+def convert(file_name):
+    """Rewrite a pickled or journaled book as a row-encoded snapshot."""
+    from AddressBook import Record
+    from storage import JournalStorage
+
+    storage = JournalStorage(file_name, record_type=Record, legacy=True)
+    data = storage.load()
+    storage.compact(data)
+    storage.close()
+    return len(data)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Convert an address book to the row encoding')
+    parser.add_argument('file', nargs='?', default='AddressBook.bin')
+    args = parser.parse_args(argv)
+    count = convert(args.file)
+    print(f'Converted {count} contacts in {args.file}')
+
+
+if __name__ == '__main__':
+    main()
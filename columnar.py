@@ -0,0 +1,223 @@
+"""Column arrays of a book for whole-book birthday and completeness reports.
+
+ColumnarIndex keeps, per contact, the birthday's day-of-year slot and
+year, the number of phones and whether there is an email, each as a
+NumPy array, and answers the 'report' command with array operations
+instead of a Python loop over the records. NumPy is optional: without it
+available is False and summarize() gives the same report with a loop.
+"""
+from calendar import isleap
+
+from indexes import FEB_29, birthday_slot
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+available = np is not None
+FIELDS = ('phone', 'email', 'birthday')
+
+
+def age_label(decade):
+    return f'{decade}-{decade + 9}'
+
+
+def days_in_year(year):
+    return 366 if isleap(year) else 365
+
+
+def day_of_year(slot, year):
+    # Slots count a leap year; in common years 29 February falls on 28th.
+    if not isleap(year) and slot >= FEB_29:
+        return slot - 1
+    return slot
+
+
+def days_until(slot, today):
+    start = today.timetuple().tm_yday - 1
+    this_year = day_of_year(slot, today.year)
+    if this_year >= start:
+        return this_year - start
+    return days_in_year(today.year) - start + \
+        day_of_year(slot, today.year + 1)
+
+
+def summarize(columns, today, days=None):
+    """The report of summary() from (key, birthday, phones, email) tuples.
+
+    birthday is a date or None. This is the loop ColumnarIndex replaces.
+    """
+    contacts = 0
+    missing = dict.fromkeys(FIELDS, 0)
+    ages = {}
+    months = [0] * 12
+    upcoming = 0
+    for key, birthday, phones, email in columns:
+        contacts += 1
+        missing['phone'] += not phones
+        missing['email'] += not email
+        if birthday is None:
+            missing['birthday'] += 1
+            continue
+        age = today.year - birthday.year - \
+            ((birthday.month, birthday.day) > (today.month, today.day))
+        decade = max(age, 0) // 10 * 10
+        ages[decade] = ages.get(decade, 0) + 1
+        months[birthday.month - 1] += 1
+        if days is not None and days_until(
+                birthday_slot(birthday.month, birthday.day), today) < days:
+            upcoming += 1
+    report = {'contacts': contacts, 'missing': missing,
+              'ages': {age_label(decade): ages[decade]
+                       for decade in sorted(ages)},
+              'birthday_months': months}
+    if days is not None:
+        report['upcoming'] = upcoming
+    return report
+
+
+class ColumnarIndex:
+    """NumPy columns of every contact, maintained like the other indexes.
+
+    columns is a function returning (birthday, phones, email) for a
+    record: a date or None, the number of phones and whether it has an
+    email. Keys get a row of the arrays; a removed key only clears its
+    live flag, and dead rows are dropped once they outnumber live ones.
+    """
+
+    def __init__(self, columns):
+        if np is None:
+            raise ImportError('ColumnarIndex needs NumPy')
+        self.columns = columns
+        self.clear()
+
+    def clear(self, capacity=1024):
+        self.rows = {}
+        self.keys = []
+        self.size = 0
+        self.dead = 0
+        self.slot = np.full(capacity, -1, dtype=np.int16)
+        self.year = np.zeros(capacity, dtype=np.int16)
+        self.month = np.zeros(capacity, dtype=np.int8)
+        self.day = np.zeros(capacity, dtype=np.int8)
+        self.phones = np.zeros(capacity, dtype=np.int16)
+        self.email = np.zeros(capacity, dtype=bool)
+        self.live = np.zeros(capacity, dtype=bool)
+
+    def grow(self):
+        for name in ('slot', 'year', 'month', 'day', 'phones', 'email',
+                     'live'):
+            old = getattr(self, name)
+            new = np.full(len(old) * 2, -1, dtype=old.dtype) \
+                if name == 'slot' else np.zeros(len(old) * 2, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, key, record):
+        row = self.rows.get(key)
+        if row is None:
+            if self.size == len(self.live):
+                self.grow()
+            row = self.rows[key] = self.size
+            self.keys.append(key)
+            self.size += 1
+        birthday, phones, email = self.columns(record)
+        if birthday is None:
+            self.slot[row] = -1
+            self.year[row] = self.month[row] = self.day[row] = 0
+        else:
+            self.slot[row] = birthday_slot(birthday.month, birthday.day)
+            self.year[row] = birthday.year
+            self.month[row] = birthday.month
+            self.day[row] = birthday.day
+        self.phones[row] = phones
+        self.email[row] = email
+        self.live[row] = True
+
+    def discard(self, key):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        self.live[row] = False
+        self.keys[row] = None
+        self.dead += 1
+        if self.dead > len(self.rows) and self.dead > 1000:
+            self.compact()
+
+    def compact(self):
+        keep = np.flatnonzero(self.live[:self.size])
+        keys = [self.keys[row] for row in keep]
+        capacity = max(1024, len(keep) * 2)
+        for name in ('slot', 'year', 'month', 'day', 'phones', 'email',
+                     'live'):
+            old = getattr(self, name)
+            new = np.full(capacity, -1, dtype=old.dtype) if name == 'slot' \
+                else np.zeros(capacity, dtype=old.dtype)
+            new[:len(keep)] = old[keep]
+            setattr(self, name, new)
+        self.keys = keys
+        self.rows = {key: row for row, key in enumerate(keys)}
+        self.size = len(keys)
+        self.dead = 0
+
+    def rebuild(self, data):
+        self.clear(max(1024, len(data)))
+        for key, record in data.items():
+            self.add(key, record)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def view(self, name):
+        return getattr(self, name)[:self.size][self.live[:self.size]]
+
+    def days_until(self, today):
+        """Days to the next birthday for each live row, -1 without one."""
+        slot = self.view('slot').astype(np.int32)
+        start = today.timetuple().tm_yday - 1
+        this_year = slot - ((slot >= FEB_29) & (not isleap(today.year)))
+        next_year = slot - ((slot >= FEB_29) & (not isleap(today.year + 1)))
+        days = np.where(this_year >= start, this_year - start,
+                        days_in_year(today.year) - start + next_year)
+        return np.where(slot < 0, -1, days)
+
+    def summary(self, today, days=None):
+        """Contacts, missing fields, age decades and birthday months."""
+        has_birthday = self.view('slot') >= 0
+        year = self.view('year')[has_birthday].astype(np.int32)
+        month = self.view('month')[has_birthday].astype(np.int32)
+        day = self.view('day')[has_birthday].astype(np.int32)
+        later = (month * 100 + day) > today.month * 100 + today.day
+        ages = np.maximum(today.year - year - later, 0) // 10 * 10
+        decades, counts = np.unique(ages, return_counts=True)
+        report = {
+            'contacts': len(self.rows),
+            'missing': {
+                'phone': int(np.count_nonzero(self.view('phones') == 0)),
+                'email': int(np.count_nonzero(~self.view('email'))),
+                'birthday': int(np.count_nonzero(~has_birthday)),
+            },
+            'ages': {age_label(int(decade)): int(count)
+                     for decade, count in zip(decades, counts)},
+            'birthday_months': np.bincount(month - 1, minlength=12)
+            .tolist(),
+        }
+        if days is not None:
+            until = self.days_until(today)
+            report['upcoming'] = int(np.count_nonzero(
+                (until >= 0) & (until < days)))
+        return report
+
+    def missing(self, field):
+        """Keys of the contacts without a phone, email or birthday."""
+        if field == 'phone':
+            lacking = self.phones[:self.size] == 0
+        elif field == 'email':
+            lacking = ~self.email[:self.size]
+        elif field == 'birthday':
+            lacking = self.slot[:self.size] < 0
+        else:
+            raise ValueError(f'Unknown field {field!r}')
+        rows = np.flatnonzero(lacking & self.live[:self.size])
+        return sorted(self.keys[row] for row in rows)
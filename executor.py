@@ -0,0 +1,106 @@
+"""Scans over every contact that no index can answer, e.g. show with a filter.
+
+A scan runs a predicate over record rows, the (name, phones, email,
+birthday) tuples of Record.to_row, and renders the rows that match.
+Rows are plain tuples, so they go to worker processes in chunks for
+little pickling, and results come back in the order of the book
+whichever way they ran. Starting a pool costs more than it saves on a
+small book, so books under PARALLEL_MIN contacts are scanned here.
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from transfer import batches
+
+CHUNK_SIZE = 5000
+PARALLEL_MIN = 100000
+
+
+class RowFilter:
+    """Matches rows whose fields contain all the given texts.
+
+    Texts compare case-insensitively; a phone text matches on its digits,
+    so '050 123' finds '+38050123...'. Phones may be a list of texts that
+    must all be found.
+    """
+    FIELDS = ('name', 'phones', 'email', 'birthday')
+
+    def __init__(self, name=None, phones=(), email=None, birthday=None):
+        self.name = name.lower() if name else None
+        if isinstance(phones, str):
+            phones = [phones]
+        self.phones = [''.join(c for c in phone if c.isdigit()) or phone
+                       for phone in phones if phone]
+        self.email = email.lower() if email else None
+        self.birthday = birthday
+
+    @classmethod
+    def from_request(cls, request):
+        return cls(**{field: request[field] for field in cls.FIELDS
+                      if request.get(field)})
+
+    def __bool__(self):
+        return bool(self.name or self.phones or self.email or self.birthday)
+
+    def __call__(self, row):
+        name, phones, email, birthday = row
+        if self.name and self.name not in name.lower():
+            return False
+        if self.email and (not email or self.email not in email.lower()):
+            return False
+        if self.birthday and (not birthday or self.birthday not in birthday):
+            return False
+        for text in self.phones:
+            if not any(text in phone for phone in phones):
+                return False
+        return True
+
+
+def render_row(row):
+    # Imported here: workers load AddressBook themselves, and it imports
+    # this module.
+    from AddressBook import Record, record_line
+
+    return record_line(row[0], Record.from_row(row))
+
+
+def scan_chunk(rows, predicate, render, decode=None):
+    if decode:
+        rows = map(decode, rows)
+    return [(row, render(row) if render else None)
+            for row in rows if predicate(row)]
+
+
+def pool_size(count, workers):
+    if workers == 0 or count < PARALLEL_MIN:
+        return 0
+    workers = min(workers or os.cpu_count() or 1, -(-count // CHUNK_SIZE))
+    # One worker would only add pickling to a serial scan.
+    return workers if workers > 1 else 0
+
+
+def scan(rows, predicate, render=None, count=0, workers=None,
+         chunk_size=CHUNK_SIZE, decode=None):
+    """Yield (row, rendered) for the rows predicate accepts, in order.
+
+    count is the number of rows, which decides between a serial and a
+    parallel scan; workers caps the processes (None for one per CPU, 0
+    to always scan serially). With decode, rows are encoded, e.g. codec
+    blobs, and are decoded where they are scanned, so a pool shares the
+    decoding too. predicate, render and decode go to the workers by
+    pickling, so they are module-level functions or plain objects.
+    """
+    workers = pool_size(count, workers)
+    if not workers:
+        yield from scan_chunk(rows, predicate, render, decode)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in batches(rows, chunk_size):
+            pending.append(pool.submit(scan_chunk, chunk, predicate, render,
+                                       decode))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
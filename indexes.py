@@ -0,0 +1,307 @@
+import base64
+import json
+import re
+from bisect import bisect_left, bisect_right, insort
+from calendar import isleap
+from datetime import date, timedelta
+
+# Day-of-year slots are counted in a leap year so 29 February has its own.
+LEAP_YEAR = 2000
+FEB_29 = date(LEAP_YEAR, 2, 29).timetuple().tm_yday - 1
+SLOT_DATES = [date(LEAP_YEAR, 1, 1) + timedelta(days=i) for i in range(366)]
+
+
+def birthday_slot(month, day):
+    return date(LEAP_YEAR, month, day).timetuple().tm_yday - 1
+
+
+def next_birthday(month, day, today):
+    """Next date on or after today; 29 February is 28 February in common
+    years.
+    """
+    year = today.year
+    while True:
+        try:
+            candidate = date(year, month, day)
+        except ValueError:
+            candidate = date(year, 2, 28)
+        if candidate >= today:
+            return candidate
+        year += 1
+
+
+def window_slots(today, days):
+    """(date, slot) pairs for the next days, wrapping past 31 December.
+
+    Each slot is visited once, so windows longer than a year stop after
+    one. In common years 28 February also yields the 29 February slot.
+    """
+    result = []
+    visited = set()
+    for offset in range(days):
+        day = today + timedelta(days=offset)
+        slot = birthday_slot(day.month, day.day)
+        if slot in visited:
+            break
+        visited.add(slot)
+        result.append((day, slot))
+        if day.month == 2 and day.day == 28 and not isleap(day.year) \
+                and FEB_29 not in visited:
+            visited.add(FEB_29)
+            result.append((day, FEB_29))
+    return result
+
+
+NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_phone(phone):
+    if phone and len(phone) == 13 and phone.startswith('+380') \
+            and phone[1:].isdigit():
+        return phone
+    digits = NON_DIGITS.sub('', phone or '')
+    if len(digits) == 10 and digits.startswith('0'):
+        digits = '38' + digits
+    elif len(digits) == 11 and digits.startswith('80'):
+        digits = '3' + digits
+    if len(digits) == 12 and digits.startswith('380'):
+        return '+' + digits
+
+
+def normalize_email(email):
+    if email:
+        return email.strip().lower()
+
+
+def connected_groups(groups):
+    """Merge key groups that share a key; returns sorted lists of keys."""
+    parent = {}
+
+    def root(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for group in groups:
+        group = list(group)
+        for key in group:
+            parent.setdefault(key, key)
+        for key in group[1:]:
+            parent[root(key)] = root(group[0])
+    merged = {}
+    for key in parent:
+        merged.setdefault(root(key), []).append(key)
+    return sorted(sorted(keys) for keys in merged.values())
+
+
+def encode_token(sort_by, position):
+    raw = json.dumps([sort_by, position]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_token(token, sort_by):
+    if token is None:
+        return None
+    try:
+        token_sort, position = json.loads(base64.urlsafe_b64decode(token))
+    except ValueError:
+        raise ValueError('Invalid page token')
+    if token_sort != sort_by:
+        raise ValueError('Page token belongs to a different sort order')
+    return position
+
+
+def prefix_upper(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class PrefixIndex:
+    """Sorted (term, key) pairs answering prefix queries with bisect.
+
+    terms is a function returning the strings a record is indexed under;
+    with key_only it is given the record key instead of the record, so
+    the index can be built without decoding any records. A prefix lookup
+    costs O(log N) to find the matching range plus O(k) to walk it, and
+    start/limit page through that range without scanning the rest of the
+    book.
+    """
+
+    def __init__(self, terms, key_only=False):
+        self.terms = terms
+        self.key_only = key_only
+        self.entries = []
+        self.keys = {}
+
+    def terms_of(self, key, record):
+        return set(self.terms(key if self.key_only else record))
+
+    def add(self, key, record):
+        self.discard(key)
+        terms = self.terms_of(key, record)
+        self.keys[key] = terms
+        for term in terms:
+            insort(self.entries, (term, key))
+
+    def discard(self, key):
+        for term in self.keys.pop(key, ()):
+            i = bisect_left(self.entries, (term, key))
+            if i < len(self.entries) and self.entries[i] == (term, key):
+                del self.entries[i]
+
+    def clear(self):
+        self.entries = []
+        self.keys = {}
+
+    def rebuild(self, data):
+        if self.key_only:
+            self.keys = {key: self.terms_of(key, None) for key in data}
+        else:
+            self.keys = {key: self.terms_of(key, record)
+                         for key, record in data.items()}
+        self.entries = sorted((term, key) for key, terms in self.keys.items()
+                              for term in terms)
+
+    def load_sorted(self, keys):
+        """Rebuild from sorted keys, for an index whose terms are its keys."""
+        self.keys = {key: {key} for key in keys}
+        self.entries = [(key, key) for key in self.keys]
+
+    def bounds(self, prefix):
+        lo = bisect_left(self.entries, (prefix,))
+        if not prefix:
+            return lo, len(self.entries)
+        return lo, bisect_left(self.entries, (prefix_upper(prefix),), lo)
+
+    def walk(self, after=None):
+        start = 0 if after is None else \
+            bisect_right(self.entries, tuple(after))
+        for i in range(start, len(self.entries)):
+            term, key = self.entries[i]
+            yield [term, key], key
+
+    def search(self, prefix, start=0, limit=None):
+        lo, hi = self.bounds(prefix)
+        lo += start
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        for i in range(lo, hi):
+            yield self.entries[i][1]
+
+
+class BirthdayIndex:
+    """366 day-of-year buckets of record keys.
+
+    birthday is a function returning (month, day) for a record, or None.
+    A window of N days is answered by walking N buckets, wrapping around
+    the end of the year, instead of parsing every record's birthday.
+    """
+
+    def __init__(self, birthday):
+        self.birthday = birthday
+        self.buckets = [set() for _ in range(366)]
+        self.keys = {}
+
+    def add(self, key, record):
+        self.discard(key)
+        month_day = self.birthday(record)
+        if month_day:
+            slot = birthday_slot(*month_day)
+            self.keys[key] = slot
+            self.buckets[slot].add(key)
+
+    def discard(self, key):
+        slot = self.keys.pop(key, None)
+        if slot is not None:
+            self.buckets[slot].discard(key)
+
+    def clear(self):
+        self.buckets = [set() for _ in range(366)]
+        self.keys = {}
+
+    def rebuild(self, data):
+        self.clear()
+        for key, record in data.items():
+            self.add(key, record)
+
+    def load_slots(self, pairs):
+        """Rebuild from stored (key, slot) pairs; a negative slot is none."""
+        self.clear()
+        for key, slot in pairs:
+            if slot >= 0:
+                self.keys[key] = slot
+                self.buckets[slot].add(key)
+
+    def days_to_birthday(self, key, today):
+        slot = self.keys.get(key)
+        if slot is None:
+            return None
+        slot_date = SLOT_DATES[slot]
+        return (next_birthday(slot_date.month, slot_date.day, today)
+                - today).days
+
+    def walk(self, after=None):
+        slot, key = after if after else (0, None)
+        for slot in range(slot, 366):
+            for name in sorted(self.buckets[slot]):
+                if key is None or name > key:
+                    yield [slot, name], name
+            key = None
+
+    def upcoming(self, today, days):
+        result = []
+        for day, slot in window_slots(today, days):
+            for key in sorted(self.buckets[slot]):
+                result.append((day, key))
+        return result
+
+
+class HashIndex:
+    """Reverse lookup from exact values to the keys of records holding them.
+
+    values is a function returning a record's normalized values, such as
+    its phone numbers. lookup() is one dict access instead of a scan of
+    every record, conflicts() tells which other keys already hold a
+    record's values and duplicates() lists the values held by several.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        self.owners = {}
+        self.keys = {}
+
+    def values_of(self, record):
+        return {value for value in self.values(record) if value}
+
+    def add(self, key, record):
+        self.discard(key)
+        values = self.values_of(record)
+        self.keys[key] = values
+        for value in values:
+            self.owners.setdefault(value, set()).add(key)
+
+    def discard(self, key):
+        for value in self.keys.pop(key, ()):
+            owners = self.owners[value]
+            owners.discard(key)
+            if not owners:
+                del self.owners[value]
+
+    def clear(self):
+        self.owners = {}
+        self.keys = {}
+
+    def rebuild(self, data):
+        self.clear()
+        for key, record in data.items():
+            self.add(key, record)
+
+    def lookup(self, value):
+        return sorted(self.owners.get(value, ()))
+
+    def conflicts(self, key, record):
+        return [(value, other) for value in sorted(self.values_of(record))
+                for other in self.lookup(value) if other != key]
+
+    def duplicates(self):
+        return [owners for owners in self.owners.values() if len(owners) > 1]
@@ -0,0 +1,78 @@
+"""Advisory lock shared by every process that opens the same book.
+
+    lock = FileLock('AddressBook.bin.lock')
+    with lock:
+        ...
+
+The lock is an flock (msvcrt.locking on Windows) on a file next to the
+book, so it only keeps out processes that take it too. Nested blocks in
+one process lock the file once; threads must not share a FileLock
+without a lock of their own around it.
+"""
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = None
+        self.depth = 0
+
+    def acquire(self):
+        if self.depth:
+            self.depth += 1
+            return
+        file = open(self.file_name, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        except BaseException:
+            file.close()
+            raise
+        self.file = file
+        self.depth = 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth:
+            return
+        file, self.file = self.file, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            file.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def read_number(file_name):
+    try:
+        with open(file_name) as f:
+            return int(f.read() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_number(file_name, number):
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'w') as f:
+        f.write(str(number))
+    os.replace(tmp_name, file_name)
@@ -0,0 +1,140 @@
+"""Opt-in counters and latency histograms for AddressBook operations.
+
+Nothing is recorded until enable() is called, and a disabled trace
+costs one flag check, so the hooks stay in the code for good.
+
+    with metrics.trace('find_records'):
+        ...
+
+    @metrics.traced('load_contacts')
+    def load_contacts(self): ...
+"""
+import contextlib
+import functools
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Histogram bucket upper bounds in seconds: 1 microsecond doubling up
+# to about 9 minutes.
+BOUNDS = [2 ** i / 1e6 for i in range(30)]
+
+enabled = False
+counters = Counter()
+histograms = {}
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile."""
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(BOUNDS[i], self.max) if i < len(BOUNDS) \
+                    else self.max
+        return 0.0
+
+    def to_dict(self):
+        return {'count': self.count,
+                'total_ms': self.total * 1e3,
+                'mean_ms': self.total / self.count * 1e3 if self.count
+                else 0.0,
+                'p50_ms': self.percentile(50) * 1e3,
+                'p95_ms': self.percentile(95) * 1e3,
+                'max_ms': self.max * 1e3}
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    counters.clear()
+    histograms.clear()
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] += n
+
+
+def observe(name, seconds):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.add(seconds)
+
+
+@contextlib.contextmanager
+def trace(name):
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def traced_iter(name, iterator):
+    """Yield from iterator, timing each step under name."""
+    iterator = iter(iterator)
+    while True:
+        start = time.perf_counter() if enabled else None
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        if start is not None:
+            observe(name, time.perf_counter() - start)
+        yield item
+
+
+def report():
+    return {'counters': dict(counters),
+            'latency': {name: histogram.to_dict()
+                        for name, histogram in sorted(histograms.items())}}
+
+
+def format_report():
+    lines = [f'{"operation":<24}{"count":>8}{"total ms":>11}{"mean ms":>10}'
+             f'{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}']
+    for name, stats in report()['latency'].items():
+        lines.append(f'{name:<24}{stats["count"]:>8}'
+                     f'{stats["total_ms"]:>11.2f}{stats["mean_ms"]:>10.3f}'
+                     f'{stats["p50_ms"]:>10.3f}{stats["p95_ms"]:>10.3f}'
+                     f'{stats["max_ms"]:>10.3f}')
+    for name, value in sorted(counters.items()):
+        lines.append(f'{name:<24}{value:>8}')
+    return '\n'.join(lines)
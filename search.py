@@ -0,0 +1,235 @@
+import heapq
+import re
+from array import array
+from collections import Counter
+
+PHONE_QUERY = re.compile(r'^[\d\s()+-]+$')
+
+# Match tiers, best first; fuzzy matches rank after them by edit distance.
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+# A search without a limit checks as many typo candidates as one for this
+# many results.
+FUZZY_LIMIT = 20
+
+
+def normalize_query(query):
+    query = (query or '').strip().lower()
+    if PHONE_QUERY.match(query) and any(c.isdigit() for c in query):
+        return re.sub(r'\D', '', query)
+    return query
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def padded_trigrams(term):
+    return trigrams(f' {term} ')
+
+
+def edit_distance(a, b, limit):
+    """Edit distance of a and b, or limit + 1 once it exceeds limit.
+
+    This is the optimal string alignment distance: Levenshtein with a swap
+    of two adjacent characters counted as one edit, so 'jonh' is one away
+    from 'john'.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1,
+                       previous[j - 1] + (char != other))
+            if i > 1 and j > 1 and char != other and char == b[j - 2] \
+                    and a[i - 2] == other:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def max_distance(query):
+    # Digits are phone fragments, where a near miss is another number.
+    if query.isdigit() or len(query) < 4:
+        return 0
+    return 1 if len(query) < 8 else 2
+
+
+def match_tier(query, terms):
+    best = None
+    for term in terms:
+        position = term.find(query)
+        if position < 0:
+            continue
+        if term == query:
+            return EXACT
+        if not position:
+            tier = PREFIX
+        elif f' {query}' in f' {term}'.replace('@', ' ').replace('.', ' '):
+            tier = WORD_PREFIX
+        else:
+            tier = SUBSTRING
+        best = tier if best is None else min(best, tier)
+    return best
+
+
+def fuzzy_distance(query, terms, limit):
+    best = limit + 1
+    for term in terms:
+        for word in {term, *term.split()}:
+            best = min(best, edit_distance(query, word, limit))
+            if not best:
+                return best
+    return best
+
+
+class TrigramIndex:
+    """Inverted index from trigrams to record keys for substring search.
+
+    terms is a function returning the strings a record is searched by;
+    they are lowercased and padded with spaces, so a query of one or two
+    characters still finds the words that start with it. Keys get integer
+    ids and posting lists are arrays of ids. A removed key only forgets
+    its id; stale ids are dropped from the postings once they outnumber
+    the live ones.
+
+    search() ranks exact, prefix, word-prefix and substring matches
+    first and fills up to limit with typo-tolerant matches: candidates
+    sharing enough trigrams with the query, checked by edit distance.
+    Without a limit, typo-tolerant matches are only looked for when
+    nothing else matched.
+    """
+
+    def __init__(self, terms):
+        self.terms = terms
+        self.clear()
+
+    def clear(self):
+        self.postings = {}
+        self.ids = {}
+        self.keys = []
+        self.key_terms = []
+        self.dead = 0
+
+    def terms_of(self, record):
+        return tuple({term.lower() for term in self.terms(record) if term})
+
+    def add(self, key, record):
+        self.discard(key)
+        self.add_terms(key, self.terms_of(record))
+
+    def discard(self, key):
+        key_id = self.ids.pop(key, None)
+        if key_id is None:
+            return
+        self.keys[key_id] = None
+        self.key_terms[key_id] = ()
+        self.dead += 1
+        if self.dead > len(self.ids) and self.dead > 1000:
+            self.compact()
+
+    def compact(self):
+        live = [(key, self.key_terms[key_id])
+                for key, key_id in self.ids.items()]
+        self.clear()
+        for key, terms in live:
+            self.add_terms(key, terms)
+
+    def add_terms(self, key, terms):
+        key_id = len(self.keys)
+        self.ids[key] = key_id
+        self.keys.append(key)
+        self.key_terms.append(terms)
+        grams = set()
+        for term in terms:
+            grams |= padded_trigrams(term)
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('I')
+            posting.append(key_id)
+
+    def rebuild(self, data):
+        self.clear()
+        for key, record in data.items():
+            self.add_terms(key, self.terms_of(record))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def candidates(self, grams):
+        postings = sorted((self.postings.get(gram, ()) for gram in grams),
+                          key=len)
+        if not postings or not postings[0]:
+            return set()
+        found = set(postings[0])
+        for posting in postings[1:3]:
+            found.intersection_update(posting)
+            if not found:
+                break
+        return found
+
+    def word_starts(self, query):
+        start = ' ' + query
+        found = set()
+        for gram, posting in self.postings.items():
+            if gram.startswith(start):
+                found.update(posting)
+        return found
+
+    def substring_matches(self, query):
+        if len(query) < 3:
+            candidates = self.word_starts(query)
+        else:
+            candidates = self.candidates(trigrams(query))
+        for key_id in candidates:
+            tier = match_tier(query, self.key_terms[key_id])
+            if tier is not None:
+                yield tier, self.keys[key_id], key_id
+
+    def fuzzy_matches(self, query, exclude, limit):
+        distance = max_distance(query)
+        if not distance:
+            return
+        postings = sorted((self.postings.get(gram, ())
+                           for gram in padded_trigrams(query)), key=len)
+        # Each edit destroys at most four of the query's trigrams (a swap
+        # of two characters does), so a match shares one of the rarest
+        # len - needed + 1 of them.
+        needed = max(1, len(postings) - 4 * distance)
+        shared = Counter()
+        for posting in postings[:len(postings) - needed + 1]:
+            shared.update(posting)
+        checked = 0
+        for key_id, count in shared.most_common():
+            if checked >= (limit or FUZZY_LIMIT) * 10:
+                break
+            if key_id in exclude or self.keys[key_id] is None:
+                continue
+            checked += 1
+            found = fuzzy_distance(query, self.key_terms[key_id], distance)
+            if found <= distance:
+                yield FUZZY + found, self.keys[key_id], key_id
+
+    def search(self, query, limit=None, fuzzy=True):
+        """Keys matching query, best first, at most limit of them."""
+        query = normalize_query(query)
+        if not query:
+            return []
+        matches = list(self.substring_matches(query))
+        # Without a limit, typos are only looked for when nothing else
+        # matched, as checking candidates costs an edit distance each.
+        if fuzzy and (not matches if limit is None
+                      else len(matches) < limit):
+            exclude = {key_id for tier, key, key_id in matches}
+            matches.extend(self.fuzzy_matches(query, exclude, limit))
+        if limit is None:
+            matches.sort()
+        else:
+            matches = heapq.nsmallest(limit, matches)
+        return [key for tier, key, key_id in matches]
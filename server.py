@@ -0,0 +1,181 @@
+"""Serve one address book to many clients over TCP or a Unix socket.
+
+    python server.py --port 8765
+    python server.py --unix /tmp/addressbook.sock
+
+The protocol is line-delimited JSON. Each request line is an object
+understood by CommandEngine, for example
+{"id": 1, "command": "find", "query": "An"}, or a plain command line
+such as 'find An'. Each response line is Result.to_dict() plus the id of
+the request when it had one. Returned records carry a record_id that
+'change' and 'delete' accept in place of a name and that survives a
+rename for as long as the server runs.
+
+Commands run in worker threads under a reader/writer lock: any number
+of reads at once, writes one at a time. Writes are not saved straight
+away; a background task saves the book's coalesced changes every
+--flush-interval seconds and once more on shutdown.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+
+from AddressBook import (AddressBook, CommandEngine, WRITE_COMMANDS,
+                         parse_command)
+from storage import PickledBookError
+
+
+class RWLock:
+    """Reader/writer lock for asyncio; waiting writers hold off new readers."""
+
+    def __init__(self):
+        self.readers = 0
+        self.writer = False
+        self.waiting = 0
+        self.condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: not self.writer and not self.waiting)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self.condition:
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(
+                    lambda: not self.writer and not self.readers)
+            finally:
+                self.waiting -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+
+class ContactServer:
+    def __init__(self, address_book, flush_interval=1.0):
+        self.address_book = address_book
+        self.engine = CommandEngine(address_book)
+        self.lock = RWLock()
+        self.flush_interval = flush_interval
+
+    def warm_indexes(self):
+        # Readers share the indexes, so build them while writes are held,
+        # the NumPy columns of 'report' too, which are only made on demand.
+        self.address_book.columns()
+        for kind in list(self.address_book.indexes):
+            self.address_book.index(kind)
+
+    async def execute(self, request):
+        if isinstance(request, str):
+            request = parse_command(request)
+        if request.get('command') in WRITE_COMMANDS:
+            async with self.lock.write():
+                result = await asyncio.to_thread(self.engine.execute, request)
+                if result.ok:
+                    await asyncio.to_thread(self.warm_indexes)
+        else:
+            async with self.lock.read():
+                result = await asyncio.to_thread(self.engine.execute, request)
+        response = result.to_dict()
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8').strip()
+                if not line:
+                    continue
+                try:
+                    request = json.loads(line) if line.startswith('{') \
+                        else line
+                except ValueError:
+                    response = {'ok': False, 'message': 'Invalid JSON'}
+                else:
+                    response = await self.execute(request)
+                writer.write(json.dumps(response, ensure_ascii=False)
+                             .encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def flush(self):
+        if not self.address_book.has_changes():
+            return
+        async with self.lock.write():
+            try:
+                await asyncio.to_thread(self.engine.save)
+            finally:
+                # Taking in other processes' saves may have left the
+                # indexes stale; rebuild them before readers come back.
+                await asyncio.to_thread(self.warm_indexes)
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as error:
+                # The changes stay pending, so the next round tries again.
+                print(f'Saving failed: {error}', file=sys.stderr)
+
+    async def serve(self, host='127.0.0.1', port=8765, unix=None):
+        self.warm_indexes()
+        if unix:
+            server = await asyncio.start_unix_server(self.handle, unix)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        flusher = asyncio.create_task(self.flush_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flusher.cancel()
+            await self.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Address Book server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH',
+                        help='listen on a Unix socket instead of TCP')
+    parser.add_argument('--flush-interval', type=float, default=1.0,
+                        help='seconds between saves of a changed book')
+    args = parser.parse_args(argv)
+    address_book = AddressBook()
+    try:
+        address_book.load_contacts()
+    except PickledBookError as error:
+        parser.exit(1, f'{error}\n')
+    server = ContactServer(address_book, args.flush_interval)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+import sqlite3
+from datetime import date, datetime
+
+import metrics
+from indexes import (birthday_slot, connected_groups, decode_token,
+                     encode_token, normalize_email, normalize_phone,
+                     prefix_upper, window_slots)
+from search import normalize_query
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    email TEXT,
+    birthday TEXT,
+    birthday_slot INTEGER
+);
+CREATE TABLE IF NOT EXISTS phones (
+    record_id INTEGER NOT NULL REFERENCES records(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    number TEXT NOT NULL,
+    PRIMARY KEY (record_id, position)
+);
+CREATE INDEX IF NOT EXISTS phones_number ON phones(number);
+CREATE INDEX IF NOT EXISTS records_birthday ON records(birthday_slot, name);
+CREATE INDEX IF NOT EXISTS records_email ON records(lower(email));
+"""
+
+# Largest number of bound parameters put in one IN (...) list.
+CHUNK = 500
+
+
+class SQLiteAddressBook:
+    """AddressBook kept in an SQLite database instead of a pickled dict.
+
+    It offers the same interface as AddressBook, but records are only
+    read when a query needs them, and name, phone and birthday lookups
+    run against indexes in the database. Changes collect in one
+    transaction that save_contacts commits.
+
+    record_type is the Record class; rows are turned back into records
+    with record_type.from_row.
+    """
+    file_name = 'AddressBook.db'
+
+    def __init__(self, file_name=None, record_type=None, unique=False):
+        if file_name:
+            self.file_name = file_name
+        self.unique = unique
+        if record_type is None:
+            from AddressBook import Record as record_type
+        self.record_type = record_type
+        self.connection = None
+
+    @metrics.traced('load_contacts')
+    def load_contacts(self):
+        self.connection = sqlite3.connect(self.file_name)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    @metrics.traced('save_contacts')
+    def save_contacts(self):
+        if not self.has_changes():
+            metrics.count('save_contacts.clean')
+            return False
+        self.connection.commit()
+        return True
+
+    def maybe_save(self):
+        return self.save_contacts()
+
+    def has_changes(self):
+        return self.connection.in_transaction
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def __contains__(self, name):
+        return self.connection.execute(
+            'SELECT 1 FROM records WHERE name = ?', (name,)).fetchone() \
+            is not None
+
+    def __getitem__(self, name):
+        rows = self.connection.execute(
+            'SELECT id, name, email, birthday FROM records WHERE name = ?',
+            (name,)).fetchall()
+        if not rows:
+            raise KeyError(name)
+        return self.build_records(rows)[0][1]
+
+    def show_all_records(self):
+        return {name: record for page in self.iterate(CHUNK)
+                for name, record in page}
+
+    @metrics.traced('add_record')
+    def add_record(self, record):
+        self.write_record(record.name.value, record)
+
+    @metrics.traced('add_records')
+    def add_records(self, records):
+        rejected = []
+        for record in records:
+            try:
+                self.write_record(record.name.value, record)
+            except ValueError as error:
+                rejected.append((record, str(error)))
+        return rejected
+
+    def update_record(self, name, record):
+        self.write_record(name, record)
+
+    def write_record(self, name, record):
+        self.check_unique(name, record)
+        month_day = record.birthday.month_day if record.birthday else None
+        values = (record.email.value if record.email else None,
+                  record.birthday.value if record.birthday else None,
+                  birthday_slot(*month_day) if month_day else None)
+        row = self.connection.execute(
+            'SELECT id FROM records WHERE name = ?', (name,)).fetchone()
+        if row:
+            record_id = row[0]
+            self.connection.execute(
+                'UPDATE records SET email = ?, birthday = ?, '
+                'birthday_slot = ? WHERE id = ?', values + (record_id,))
+            self.connection.execute(
+                'DELETE FROM phones WHERE record_id = ?', (record_id,))
+        else:
+            record_id = self.connection.execute(
+                'INSERT INTO records (name, email, birthday, birthday_slot) '
+                'VALUES (?, ?, ?, ?)', (name,) + values).lastrowid
+        self.connection.executemany(
+            'INSERT INTO phones (record_id, position, value, number) '
+            'VALUES (?, ?, ?, ?)',
+            [(record_id, i, phone.value, phone.number)
+             for i, phone in enumerate(record.phones)])
+
+    def remove_record(self, name):
+        record = self[name]
+        self.connection.execute('DELETE FROM records WHERE name = ?', (name,))
+        return record
+
+    def rename_record(self, old, new, record=None):
+        """Move the contact at old to new; its row and id stay the same."""
+        if new in self:
+            raise ValueError(f'Contact {new} already exists')
+        if record is None:
+            record = self[old]
+            record.name = type(record.name)(new)
+        self.check_unique(old, record)
+        if not self.connection.execute(
+                'UPDATE records SET name = ? WHERE name = ?',
+                (new, old)).rowcount:
+            raise KeyError(old)
+        self.write_record(new, record)
+        return record
+
+    def record_id(self, name):
+        row = self.connection.execute(
+            'SELECT id FROM records WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def name_of(self, record_id):
+        row = self.connection.execute(
+            'SELECT name FROM records WHERE id = ?', (record_id,)).fetchone()
+        if not row:
+            raise KeyError(record_id)
+        return row[0]
+
+    def clear_records(self):
+        self.connection.execute('DELETE FROM phones')
+        self.connection.execute('DELETE FROM records')
+
+    def check_unique(self, name, record):
+        if not self.unique:
+            return
+        for phone in record.phones:
+            row = self.connection.execute(
+                'SELECT records.name FROM phones '
+                'JOIN records ON records.id = phones.record_id '
+                'WHERE number = ? AND records.name != ? LIMIT 1',
+                (phone.number, name)).fetchone()
+            if row:
+                raise ValueError(f'{phone.number} already belongs to {row[0]}')
+        if record.email:
+            email = normalize_email(record.email.value)
+            row = self.connection.execute(
+                'SELECT name FROM records WHERE lower(email) = ? '
+                'AND name != ? LIMIT 1', (email, name)).fetchone()
+            if row:
+                raise ValueError(f'{email} already belongs to {row[0]}')
+
+    def find_by_phone(self, phone):
+        number = normalize_phone(phone) or phone
+        return self.build_records(self.connection.execute(
+            'SELECT DISTINCT records.id, name, email, birthday FROM phones '
+            'JOIN records ON records.id = phones.record_id '
+            'WHERE number = ? ORDER BY name', (number,)).fetchall())
+
+    def find_by_email(self, email):
+        return self.build_records(self.connection.execute(
+            'SELECT id, name, email, birthday FROM records '
+            'WHERE lower(email) = ? ORDER BY name',
+            (normalize_email(email),)).fetchall())
+
+    def duplicate_groups(self):
+        groups = {}
+        for value, name in self.connection.execute(
+                'SELECT number, records.name FROM phones '
+                'JOIN records ON records.id = phones.record_id '
+                'WHERE number IN (SELECT number FROM phones GROUP BY number '
+                'HAVING COUNT(DISTINCT record_id) > 1) '
+                'UNION SELECT lower(email), name FROM records '
+                'WHERE lower(email) IN (SELECT lower(email) FROM records '
+                'WHERE email IS NOT NULL GROUP BY lower(email) '
+                'HAVING COUNT(*) > 1)'):
+            groups.setdefault(value, set()).add(name)
+        return connected_groups(groups.values())
+
+    def build_records(self, rows):
+        phones = {}
+        ids = [row[0] for row in rows]
+        for i in range(0, len(ids), CHUNK):
+            chunk = ids[i:i + CHUNK]
+            marks = ', '.join('?' * len(chunk))
+            for record_id, value in self.connection.execute(
+                    f'SELECT record_id, value FROM phones '
+                    f'WHERE record_id IN ({marks}) '
+                    f'ORDER BY record_id, position', chunk):
+                phones.setdefault(record_id, []).append(value)
+        return [(name, self.record_type.from_row(
+                    (name, phones.get(record_id, ()), email, birthday)))
+                for record_id, name, email, birthday in rows]
+
+    def records_named(self, names):
+        rows = {}
+        for i in range(0, len(names), CHUNK):
+            chunk = names[i:i + CHUNK]
+            marks = ', '.join('?' * len(chunk))
+            for row in self.connection.execute(
+                    f'SELECT id, name, email, birthday FROM records '
+                    f'WHERE name IN ({marks})', chunk):
+                rows[row[1]] = row
+        return self.build_records([rows[name] for name in names])
+
+    def name_range(self, prefix):
+        if not prefix:
+            return 'name IS NOT NULL', ()
+        return 'name >= ? AND name < ?', (prefix, prefix_upper(prefix))
+
+    @metrics.traced('find_records')
+    def find_records(self, query, start=0, limit=None, fuzzy=True):
+        # LIKE gives case-insensitive substring matches, ranked like
+        # TrigramIndex.search; typo-tolerant matching is not offered here.
+        query = normalize_query(query)
+        if not query:
+            return []
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%') \
+            .replace('_', '\\_')
+        rows = self.connection.execute(
+            "SELECT name FROM ("
+            "SELECT name, CASE WHEN lower(name) = :query "
+            "OR lower(email) = :query THEN 0 "
+            "WHEN name LIKE :prefix ESCAPE '\\' "
+            "OR email LIKE :prefix ESCAPE '\\' THEN 1 ELSE 3 END AS tier "
+            "FROM records WHERE name LIKE :pattern ESCAPE '\\' "
+            "OR email LIKE :pattern ESCAPE '\\' "
+            "UNION ALL SELECT records.name, 3 FROM phones "
+            "JOIN records ON records.id = phones.record_id "
+            "WHERE phones.number LIKE :pattern ESCAPE '\\') "
+            "GROUP BY name ORDER BY min(tier), name "
+            "LIMIT :limit OFFSET :start",
+            {'query': query, 'prefix': escaped + '%',
+             'pattern': '%' + escaped + '%',
+             'limit': -1 if limit is None else limit, 'start': start})
+        return self.records_named([name for name, in rows])
+
+    @metrics.traced('scan')
+    def scan(self, predicate, render=None, workers=None):
+        import executor
+
+        rows = (record.to_row() for page in self.iterate(CHUNK)
+                for name, record in page)
+        return [(row[0], line) for row, line in executor.scan(
+            rows, predicate, render, len(self), workers)]
+
+    def match_names(self, prefix):
+        where, params = self.name_range(prefix)
+        return self.build_records(self.connection.execute(
+            f'SELECT id, name, email, birthday FROM records WHERE {where} '
+            f'ORDER BY name', params).fetchall())
+
+    @metrics.traced('upcoming_birthdays')
+    def upcoming_birthdays(self, days, today=None):
+        today = today or datetime.now().date()
+        days_by_slot = {slot: day for day, slot in window_slots(today, days)}
+        rows = []
+        slots = list(days_by_slot)
+        for i in range(0, len(slots), CHUNK):
+            chunk = slots[i:i + CHUNK]
+            marks = ', '.join('?' * len(chunk))
+            rows.extend(self.connection.execute(
+                f'SELECT id, name, email, birthday, birthday_slot '
+                f'FROM records WHERE birthday_slot IN ({marks})', chunk))
+        rows.sort(key=lambda row: (days_by_slot[row[4]], row[1]))
+        records = self.build_records([row[:4] for row in rows])
+        return [(days_by_slot[row[4]], name, record)
+                for row, (name, record) in zip(rows, records)]
+
+    @metrics.traced('summary')
+    def summary(self, today=None, days=None):
+        import columnar
+        import validators
+
+        today = today or datetime.now().date()
+        columns = []
+        for name, birthday, phones, email in self.connection.execute(
+                'SELECT name, birthday, '
+                '(SELECT COUNT(*) FROM phones WHERE record_id = records.id), '
+                'email IS NOT NULL FROM records'):
+            ordinal = validators.parse_birthday(birthday) if birthday \
+                else None
+            columns.append((name, date.fromordinal(ordinal) if ordinal
+                            else None, phones, email))
+        return columnar.summarize(columns, today, days)
+
+    def missing_contacts(self, field):
+        where = {
+            'phone': 'NOT EXISTS (SELECT 1 FROM phones '
+                     'WHERE record_id = records.id)',
+            'email': 'email IS NULL',
+            'birthday': 'birthday IS NULL',
+        }.get(field)
+        if where is None:
+            raise ValueError(f'Unknown field {field!r}')
+        return self.build_records(self.connection.execute(
+            f'SELECT id, name, email, birthday FROM records WHERE {where} '
+            f'ORDER BY name').fetchall())
+
+    def iterate(self, n=1, sort_by=None, token=None):
+        return metrics.traced_iter('iterate',
+                                   self.iter_pages(n, sort_by, token))
+
+    def iter_pages(self, n, sort_by, token):
+        while True:
+            page, token = self.page(n, token, sort_by)
+            if page:
+                yield page
+            if token is None:
+                return
+
+    def page(self, n=10, token=None, sort_by=None):
+        after = decode_token(token, sort_by)
+        if sort_by is None:
+            order = ('id',)
+        elif sort_by == 'name':
+            order = ('name',)
+        elif sort_by == 'birthday':
+            order = ('COALESCE(birthday_slot, 366)', 'name')
+        else:
+            raise ValueError(f'Unknown sort key {sort_by!r}')
+        columns = ', '.join(order)
+        where = ''
+        params = []
+        if after is not None:
+            marks = ', '.join('?' * len(order))
+            where = f'WHERE ({columns}) > ({marks})'
+            params = list(after)
+        rows = self.connection.execute(
+            f'SELECT id, name, email, birthday, {columns} FROM records '
+            f'{where} ORDER BY {columns} LIMIT ?', params + [n + 1]).fetchall()
+        token = None
+        if len(rows) > n:
+            rows = rows[:n]
+            token = encode_token(sort_by, list(rows[-1][4:]))
+        return self.build_records([row[:4] for row in rows]), token
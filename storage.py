@@ -0,0 +1,751 @@
+import mmap
+import os
+import pickle
+import struct
+import zlib
+from collections.abc import ItemsView, Mapping, MutableMapping
+from datetime import date
+
+import codec
+import validators
+from indexes import birthday_slot
+from locking import FileLock, read_number, write_number
+
+# Snapshot flags: blobs are codec rows rather than pickled records, and
+# the file ends with every record's birthday slot.
+ROWS = 1
+SLOTS = 2
+
+
+class PickledBookError(ValueError):
+    """A book or journal frame in the old pickle format.
+
+    Loading a pickle can run arbitrary code, so a row-format storage
+    refuses them; 'python codec.py FILE' converts such a book once.
+    """
+
+    def __init__(self, file_name):
+        super().__init__(f'{file_name} holds pickled records; convert it '
+                         f'with: python codec.py {file_name}')
+
+
+def apply_change(data, change):
+    op = change[0]
+    if op == 'put':
+        data[change[1]] = change[2]
+    elif op == 'del':
+        data.pop(change[1], None)
+    elif op == 'clear':
+        data.clear()
+    else:
+        raise ValueError(f'Unknown journal operation {op!r}')
+
+
+class MappedSnapshot(Mapping):
+    """Read-only view of a snapshot file opened with mmap.
+
+    The file holds a fixed header, the length-prefixed record blobs, the
+    record names and finally a table of (name offset, name length, blob
+    offset) entries sorted by the UTF-8 name. Lookups binary-search the
+    table in place, so opening the file reads nothing but the header and
+    only the records that are asked for get decoded. flags tells how the
+    blobs are encoded; loads decodes one.
+
+    With the SLOTS flag the table is followed by a 16-bit birthday slot
+    per entry (-1 for none), so a birthday index can be built at start
+    without decoding a single record.
+    """
+    magic = b'ABMM'
+    version = 1
+    header = struct.Struct('<4sHHQQ')
+    entry = struct.Struct('<QIQ')
+    length = struct.Struct('<I')
+
+    def __init__(self, file_name, loads=pickle.loads):
+        self.loads = loads
+        self.file = open(file_name, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            magic, version, self.flags, self.count, self.table = \
+                self.header.unpack_from(self.map, 0)
+        except (ValueError, struct.error):
+            self.file.close()
+            raise ValueError(f'{file_name} is not a snapshot file')
+        if magic != self.magic or version != self.version:
+            self.close()
+            raise ValueError(f'{file_name} has an unsupported format')
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def name_bytes(self, i):
+        name_offset, name_length, blob_offset = self.entry.unpack_from(
+            self.map, self.table + i * self.entry.size)
+        return self.map[name_offset:name_offset + name_length]
+
+    def bisect(self, name, right=False):
+        """Position of the first entry above name, or not below it."""
+        key = name.encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = self.name_bytes(mid)
+            if found < key or right and found == key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, name):
+        lo = self.bisect(name)
+        if lo < self.count and self.name_bytes(lo) == name.encode():
+            return lo
+        return -1
+
+    def blob(self, name):
+        i = self.find(name)
+        if i < 0:
+            raise KeyError(name)
+        blob_offset = self.entry.unpack_from(
+            self.map, self.table + i * self.entry.size)[2]
+        length, = self.length.unpack_from(self.map, blob_offset)
+        start = blob_offset + self.length.size
+        return self.map[start:start + length]
+
+    def __getitem__(self, name):
+        return self.loads(self.blob(name))
+
+    def __contains__(self, name):
+        return self.find(name) >= 0
+
+    def entries(self):
+        table = self.map[self.table:self.table + self.count * self.entry.size]
+        return self.entry.iter_unpack(table)
+
+    def iter_blobs(self):
+        """(name, blob) in table order, without a lookup per name."""
+        for name_offset, name_length, blob_offset in self.entries():
+            length, = self.length.unpack_from(self.map, blob_offset)
+            start = blob_offset + self.length.size
+            yield (self.map[name_offset:name_offset + name_length].decode(),
+                   self.map[start:start + length])
+
+    def iter_items(self, skip=()):
+        """(name, record) in table order; names in skip come with None."""
+        for name, blob in self.iter_blobs():
+            yield name, None if name in skip else self.loads(blob)
+
+    def birthday_slots(self):
+        """(name, slot) for every record, or None if the file has none."""
+        if not self.flags & SLOTS:
+            return None
+        offset = self.table + self.count * self.entry.size
+        slots = struct.unpack_from(f'<{self.count}h', self.map, offset)
+        return zip(self, slots)
+
+    def names_after(self, name=None):
+        """Names in table order, which is sorted, from the first above name."""
+        start = 0 if name is None else self.bisect(name, right=True)
+        for i in range(start, self.count):
+            yield self.name_bytes(i).decode()
+
+    def __iter__(self):
+        for name_offset, name_length, blob_offset in self.entries():
+            yield self.map[name_offset:name_offset + name_length].decode()
+
+    def __len__(self):
+        return self.count
+
+
+def write_snapshot(file_name, blobs, flags=0, slot_of=None):
+    """Write (name, blob) pairs as a snapshot; slot_of(blob) adds SLOTS."""
+    header = MappedSnapshot.header
+    entries = []
+    if slot_of is not None:
+        flags |= SLOTS
+    with open(file_name, 'wb') as f:
+        f.write(bytes(header.size))
+        offset = header.size
+        for name, blob in blobs:
+            entries.append((name.encode(), offset,
+                            slot_of(blob) if slot_of else -1))
+            f.write(MappedSnapshot.length.pack(len(blob)))
+            f.write(blob)
+            offset += MappedSnapshot.length.size + len(blob)
+        entries.sort()
+        table = []
+        for name, blob_offset, slot in entries:
+            table.append(MappedSnapshot.entry.pack(offset, len(name),
+                                                   blob_offset))
+            f.write(name)
+            offset += len(name)
+        f.write(b''.join(table))
+        if slot_of is not None:
+            f.write(struct.pack(f'<{len(entries)}h',
+                                *(slot for name, blob_offset, slot
+                                  in entries)))
+        f.seek(0)
+        f.write(header.pack(MappedSnapshot.magic, MappedSnapshot.version,
+                            flags, len(entries), offset))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def open_snapshot(file_name, pickles=False):
+    try:
+        with open(file_name, 'rb') as f:
+            magic = f.read(len(MappedSnapshot.magic))
+            if not magic:
+                return {}
+            if magic != MappedSnapshot.magic:
+                # AddressBook.bin written before the mapped format.
+                if not pickles:
+                    raise PickledBookError(file_name)
+                f.seek(0)
+                return pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    return MappedSnapshot(file_name)
+
+
+class RecordFormat:
+    """How records become snapshot blobs and journal frames.
+
+    With a record_type (a class with to_row and from_row) records are
+    written as codec rows, which load without pickle; without one they
+    are pickled as before. A row format reads pickled snapshots and
+    frames only with legacy, which codec.convert sets to migrate a book;
+    otherwise they raise PickledBookError.
+    """
+
+    def __init__(self, record_type=None, legacy=False):
+        self.record_type = record_type
+        self.pickles = legacy or not record_type
+        self.flags = ROWS if record_type else 0
+        # Row snapshots also store birthday slots for a warm start.
+        self.slot_of = self.birthday_slot if record_type else None
+
+    def dumps(self, record):
+        if self.record_type:
+            return codec.encode_row(record.to_row())
+        return pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+
+    def load_row(self, blob):
+        if not self.record_type:
+            raise ValueError('Row-encoded records need a record_type')
+        return self.record_type.from_row(codec.decode_row(blob))
+
+    @staticmethod
+    def birthday_slot(blob):
+        # The birthday is the last field of a row, so only it is decoded.
+        birthday = bytes(blob).rpartition(codec.FIELD_SEP.encode())[2]
+        ordinal = validators.parse_birthday(birthday.decode()) \
+            if birthday else None
+        if ordinal is None:
+            return -1
+        day = date.fromordinal(ordinal)
+        return birthday_slot(day.month, day.day)
+
+    def open(self, file_name):
+        snapshot = open_snapshot(file_name, self.pickles)
+        if isinstance(snapshot, MappedSnapshot):
+            if snapshot.flags & ROWS:
+                snapshot.loads = self.load_row
+            elif not self.pickles:
+                snapshot.close()
+                raise PickledBookError(file_name)
+        return snapshot
+
+    def same_blobs(self, snapshot):
+        return isinstance(snapshot, MappedSnapshot) and \
+            snapshot.flags & ROWS == self.flags
+
+    def dump_change(self, change):
+        if not self.record_type:
+            return pickle.dumps(change, pickle.HIGHEST_PROTOCOL)
+        op = change[0]
+        if op == 'put':
+            key = change[1].encode()
+            return b'P' + codec.LENGTH.pack(len(key)) + key + \
+                self.dumps(change[2])
+        if op == 'del':
+            return b'D' + change[1].encode()
+        return b'C'
+
+    def load_change(self, payload):
+        op = payload[:1]
+        if op == b'P':
+            size, = codec.LENGTH.unpack_from(payload, 1)
+            start = 1 + codec.LENGTH.size
+            return ('put', payload[start:start + size].decode(),
+                    self.load_row(payload[start + size:]))
+        if op == b'D':
+            return ('del', payload[1:].decode())
+        if op == b'C':
+            return ('clear',)
+        if not self.pickles:
+            raise PickledBookError(None)
+        return pickle.loads(payload)
+
+
+class LazyRecords(MutableMapping):
+    """Records of a snapshot decoded on first access, plus local changes.
+
+    Decoded and changed records live in local and the keys of the changed
+    ones in changed; snapshot keys that were deleted are kept in removed
+    and keys the snapshot never had in new.
+    """
+
+    def __init__(self, base=None):
+        self.rebase(base)
+
+    def rebase(self, base):
+        self.base = base if base is not None else {}
+        self.local = {}
+        self.changed = set()
+        self.removed = set()
+        self.new = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.local[key]
+        except KeyError:
+            pass
+        if key in self.removed:
+            raise KeyError(key)
+        record = self.base[key]
+        self.local[key] = record
+        return record
+
+    def __setitem__(self, key, record):
+        if key not in self.local:
+            if key in self.removed:
+                self.removed.discard(key)
+            elif key not in self.base:
+                self.new[key] = None
+        self.local[key] = record
+        self.changed.add(key)
+
+    def __delitem__(self, key):
+        self.changed.discard(key)
+        if key in self.new:
+            del self.new[key]
+            del self.local[key]
+        elif key not in self.removed and key in self.base:
+            self.local.pop(key, None)
+            self.removed.add(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self.local:
+            return True
+        return key not in self.removed and key in self.base
+
+    def __iter__(self):
+        for key in self.base:
+            if key not in self.removed:
+                yield key
+        yield from self.new
+
+    def __len__(self):
+        return len(self.base) - len(self.removed) + len(self.new)
+
+    def clear(self):
+        self.rebase(None)
+
+    def items(self):
+        return LazyItems(self)
+
+    def iter_items(self):
+        if not hasattr(self.base, 'iter_items'):
+            for key in self:
+                yield key, self[key]
+            return
+        # Snapshot records are read in file order instead of looked up.
+        for key, record in self.base.iter_items(skip=self.local):
+            if key in self.removed:
+                continue
+            if record is None:
+                record = self.local[key]
+            else:
+                self.local[key] = record
+            yield key, record
+        for key in self.new:
+            yield key, self.local[key]
+
+    def iter_blobs(self, dumps):
+        """Encoded records in iteration order, straight from the snapshot.
+
+        Only records changed since are encoded with dumps, so nothing is
+        looked up, decoded or kept in local.
+        """
+        for key, blob in self.base.iter_blobs():
+            if key in self.removed:
+                continue
+            record = self.local.get(key)
+            yield blob if record is None else dumps(record)
+        for key in self.new:
+            yield dumps(self.local[key])
+
+
+class LazyItems(ItemsView):
+    def __iter__(self):
+        return self._mapping.iter_items()
+
+
+class JournalStorage:
+    """Snapshot file plus an append-only journal of per-record changes.
+
+    load returns a LazyRecords over the memory-mapped snapshot with the
+    journal replayed on top, so only records that are used get decoded.
+    A save appends only the changed records to the journal, so its cost
+    does not depend on the size of the book. Once the journal holds more
+    than compact_every entries it is folded into a fresh snapshot.
+
+    Every journal frame carries its length and a CRC32. On load the
+    snapshot is read and the journal replayed on top of it; a torn or
+    corrupt frame at the tail (a crash in the middle of a save) ends the
+    replay and is cut off. Journal operations overwrite whole records, so
+    replaying a journal over a snapshot that already contains it (a crash
+    between the snapshot rename and the journal truncation) is harmless.
+
+    record_type selects the codec row format and legacy lets it read
+    pickles, see RecordFormat.
+
+    Several processes may share the files. Loads, saves and compactions
+    hold the advisory lock in file_name + '.lock'. Each compaction bumps
+    the number in file_name + '.epoch' and keeps the journal it folded
+    in as a '.prev' file. poll() returns the changes other processes saved
+    since this one last read or wrote. It reads the journal from the
+    offset this process has reached, and after one compaction it reads
+    the rest of the previous journal first. A process more than one
+    compaction behind has to load again.
+    """
+    header = struct.Struct('>II')
+
+    def __init__(self, file_name, compact_every=1000, record_type=None,
+                 legacy=False):
+        self.file_name = file_name
+        self.journal_name = file_name + '.journal'
+        self.epoch_name = file_name + '.epoch'
+        self.lock = FileLock(file_name + '.lock')
+        self.compact_every = compact_every
+        self.format = RecordFormat(record_type, legacy)
+        self.entries = 0
+        self.epoch = 0
+        # Journal bytes already reflected in the loaded records.
+        self.offset = 0
+        self.snapshot = None
+
+    def close(self):
+        if isinstance(self.snapshot, MappedSnapshot):
+            self.snapshot.close()
+        self.snapshot = None
+
+    def load(self):
+        with self.lock:
+            self.close()
+            self.epoch = read_number(self.epoch_name)
+            self.snapshot = self.format.open(self.file_name)
+            data = LazyRecords(self.snapshot)
+            self.entries = 0
+            self.offset = 0
+            try:
+                with open(self.journal_name, 'r+b') as f:
+                    end = 0
+                    for end, change in self.read_frames(f):
+                        apply_change(data, change)
+                        self.entries += 1
+                    f.truncate(end)
+                    self.offset = end
+            except FileNotFoundError:
+                pass
+        return data
+
+    def read_journal(self, file_name, offset):
+        """(changes, end) of the frames after offset; None if it shrank."""
+        try:
+            f = open(file_name, 'rb')
+        except FileNotFoundError:
+            return ([], 0) if not offset else None
+        with f:
+            if f.seek(0, os.SEEK_END) < offset:
+                return None
+            f.seek(offset)
+            changes = []
+            for offset, change in self.read_frames(f, offset):
+                changes.append(change)
+            return changes, offset
+
+    def poll(self):
+        """Changes saved by other processes since load or the last save.
+
+        None means the book was compacted more than once since then and
+        has to be loaded again.
+        """
+        with self.lock:
+            epoch = read_number(self.epoch_name)
+            changes = []
+            if epoch == self.epoch + 1:
+                # The mapped snapshot is the old file, still readable after
+                # the rename, so the old journal's tail brings it forward.
+                read = self.read_journal(self.journal_name + '.prev',
+                                         self.offset)
+                if read is None:
+                    return None
+                changes = read[0]
+                self.epoch = epoch
+                self.offset = 0
+                self.entries = 0
+            elif epoch != self.epoch:
+                return None
+            read = self.read_journal(self.journal_name, self.offset)
+            if read is None:
+                return None
+            changes.extend(read[0])
+            self.entries += len(read[0])
+            self.offset = read[1]
+            return changes
+
+    def read_frames(self, f, offset=0):
+        while True:
+            head = f.read(self.header.size)
+            if len(head) < self.header.size:
+                return
+            length, crc = self.header.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            try:
+                change = self.format.load_change(payload)
+            except PickledBookError:
+                raise PickledBookError(self.file_name)
+            except ValueError:
+                # The frame is intact, so this is not a torn write.
+                raise
+            except Exception:
+                return
+            offset += self.header.size + length
+            yield offset, change
+
+    def save(self, data, changes):
+        """Append changes; callers sharing the book poll() first."""
+        if not changes:
+            return
+        with self.lock:
+            self.cut_torn_tail()
+            frames = []
+            for change in changes:
+                payload = self.format.dump_change(change)
+                frames.append(self.header.pack(len(payload),
+                                               zlib.crc32(payload)))
+                frames.append(payload)
+            with open(self.journal_name, 'ab') as f:
+                f.write(b''.join(frames))
+                f.flush()
+                os.fsync(f.fileno())
+                self.offset = f.tell()
+            self.entries += len(changes)
+            # Compacting after the append leaves every change in the
+            # journal that becomes '.prev', where other processes read it.
+            if self.entries > self.compact_every:
+                self.compact(data)
+
+    def cut_torn_tail(self):
+        # A process that died in the middle of a save leaves part of a
+        # frame behind; frames appended after it could never be read.
+        read = self.read_journal(self.journal_name, self.offset)
+        if read is None or not os.path.exists(self.journal_name):
+            return
+        with open(self.journal_name, 'r+b') as f:
+            if f.seek(0, os.SEEK_END) > read[1]:
+                f.truncate(read[1])
+
+    def snapshot_blobs(self, data):
+        if not (isinstance(data, LazyRecords) and
+                self.format.same_blobs(data.base)):
+            for name in data:
+                yield name, self.format.dumps(data[name])
+            return
+        for name, blob in data.base.iter_blobs():
+            if name in data.removed:
+                continue
+            if name in data.local:
+                blob = self.format.dumps(data.local[name])
+            yield name, blob
+        for name in data.new:
+            yield name, self.format.dumps(data.local[name])
+
+    def compact(self, data):
+        with self.lock:
+            tmp_name = self.file_name + '.tmp'
+            write_snapshot(tmp_name, self.snapshot_blobs(data),
+                           self.format.flags, self.format.slot_of)
+            self.close()
+            os.replace(tmp_name, self.file_name)
+            if os.path.exists(self.journal_name):
+                os.replace(self.journal_name, self.journal_name + '.prev')
+            with open(self.journal_name, 'wb'):
+                pass
+            self.epoch = read_number(self.epoch_name) + 1
+            write_number(self.epoch_name, self.epoch)
+            self.entries = 0
+            self.offset = 0
+            self.snapshot = self.format.open(self.file_name)
+            if isinstance(data, LazyRecords):
+                data.rebase(self.snapshot)
+
+
+def shard_of(name, shards):
+    return zlib.crc32(name.encode()) % shards
+
+
+class ShardedSnapshot(Mapping):
+    """Read-only union of shard snapshots; each name lives in one shard."""
+
+    def __init__(self, shards):
+        self.shards = shards
+
+    def shard(self, name):
+        return self.shards[shard_of(name, len(self.shards))]
+
+    def blob(self, name):
+        return self.shard(name).blob(name)
+
+    def __getitem__(self, name):
+        return self.shard(name)[name]
+
+    def __contains__(self, name):
+        return name in self.shard(name)
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield from shard
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def iter_items(self, skip=()):
+        for shard in self.shards:
+            if isinstance(shard, MappedSnapshot):
+                yield from shard.iter_items(skip)
+            else:
+                for name in shard:
+                    yield name, None if name in skip else shard[name]
+
+    def birthday_slots(self):
+        slots = [shard.birthday_slots() for shard in self.shards
+                 if isinstance(shard, MappedSnapshot)]
+        if len(slots) < len(self.shards) or None in slots:
+            return None
+        return (pair for shard in slots for pair in shard)
+
+    def close(self):
+        for shard in self.shards:
+            if isinstance(shard, MappedSnapshot):
+                shard.close()
+
+
+class ShardedStorage:
+    """The book split by a hash of the name over several snapshot files.
+
+    Every shard is a mapped snapshot, so load only reads the shard
+    headers and records are decoded when used. A save rewrites just the
+    shards its changes fall into (each one atomically, through a temp
+    file and a rename); untouched records are copied as raw blobs. The
+    number of shards is kept in file_name + '.shards'; a book saved as a
+    single file is read once and then written out as shards.
+    """
+
+    def __init__(self, file_name, shards=8, record_type=None):
+        self.file_name = file_name
+        self.format = RecordFormat(record_type)
+        self.count_name = file_name + '.shards'
+        self.shards = shards
+        self.snapshot = None
+        self.legacy = None
+        self.dirty = set()
+
+    def shard_name(self, i):
+        return f'{self.file_name}.shard{i}'
+
+    def close(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+        if self.legacy is not None:
+            self.legacy.close()
+        self.snapshot = None
+        self.legacy = None
+
+    def open_shards(self):
+        return ShardedSnapshot([self.format.open(self.shard_name(i))
+                                for i in range(self.shards)])
+
+    def load(self):
+        self.close()
+        self.dirty = set()
+        try:
+            with open(self.count_name) as f:
+                self.shards = int(f.read())
+        except FileNotFoundError:
+            if os.path.exists(self.file_name) or \
+                    os.path.exists(self.file_name + '.journal'):
+                self.legacy = JournalStorage(
+                    self.file_name, record_type=self.format.record_type)
+                return self.legacy.load()
+        self.snapshot = self.open_shards()
+        return LazyRecords(self.snapshot)
+
+    def save(self, data, changes):
+        sharded = isinstance(data, LazyRecords) and \
+            isinstance(data.base, ShardedSnapshot)
+        if not sharded:
+            # Not read from the shard files: write the whole book.
+            self.dirty.update(range(self.shards))
+        for change in changes:
+            if change[0] == 'clear':
+                self.dirty.update(range(self.shards))
+            else:
+                self.dirty.add(shard_of(change[1], self.shards))
+        if not changes or not self.dirty:
+            return
+        names = [[] for _ in range(self.shards)]
+        for name in data.new if sharded else data:
+            names[shard_of(name, self.shards)].append(name)
+        written = []
+        for i in sorted(self.dirty):
+            tmp_name = self.shard_name(i) + '.tmp'
+            write_snapshot(tmp_name, self.shard_blobs(data, i, names[i]),
+                           self.format.flags, self.format.slot_of)
+            written.append((tmp_name, self.shard_name(i)))
+        # Mapped files cannot be replaced everywhere, so close them first.
+        self.close()
+        for tmp_name, shard_name in written:
+            os.replace(tmp_name, shard_name)
+        with open(self.count_name, 'w') as f:
+            f.write(str(self.shards))
+        self.dirty = set()
+        self.snapshot = self.open_shards()
+        if isinstance(data, LazyRecords):
+            data.rebase(self.snapshot)
+
+    def shard_blobs(self, data, i, names):
+        base = data.base if isinstance(data, LazyRecords) else None
+        if isinstance(base, ShardedSnapshot):
+            shard = base.shards[i]
+            if self.format.same_blobs(shard):
+                for name, blob in shard.iter_blobs():
+                    if name in data.removed:
+                        continue
+                    if name in data.local:
+                        blob = self.format.dumps(data.local[name])
+                    yield name, blob
+            else:
+                for name in shard:
+                    if name not in data.removed:
+                        yield name, self.format.dumps(data[name])
+        for name in names:
+            yield name, self.format.dumps(data[name])
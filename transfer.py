@@ -0,0 +1,191 @@
+import csv
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import validators
+
+COLUMNS = ('name', 'phones', 'email', 'birthday')
+BATCH_SIZE = 1000
+EMPTY_ROW = ('', (), None, None)
+
+
+def is_csv(file_name):
+    return file_name.lower().endswith('.csv')
+
+
+def split_phones(phones):
+    if not phones:
+        return []
+    if isinstance(phones, str):
+        phones = phones.split(';')
+    elif not isinstance(phones, list):
+        phones = [phones]
+    return phones
+
+
+def text(value):
+    return '' if value is None else str(value).strip()
+
+
+def make_row(item):
+    """(row, error) for one CSV or JSON item; error is None if well-formed."""
+    if not isinstance(item, dict):
+        return EMPTY_ROW, 'not a JSON object'
+    phones = split_phones(item.get('phones') or item.get('phone'))
+    fields = [item.get('name'), item.get('email'), item.get('birthday')]
+    error = None
+    if any(value is not None and not isinstance(value, str)
+           for value in fields + phones):
+        error = 'fields must be text'
+    name, email, birthday = (text(value) for value in fields)
+    phones = tuple(text(phone) for phone in phones if text(phone))
+    return (name, phones, email or None, birthday or None), error
+
+
+def read_rows(file_name):
+    """Yield (row, error) for every item of a CSV or JSON Lines file."""
+    with open(file_name, newline='', encoding='utf-8') as f:
+        if is_csv(file_name):
+            for item in csv.DictReader(f):
+                yield make_row(item)
+        else:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    yield EMPTY_ROW, f'line {number} is not valid JSON'
+                    continue
+                row, error = make_row(item)
+                yield row, error and f'line {number}: {error}'
+
+
+def row_item(row):
+    name, phones, email, birthday = row
+    return {'name': name, 'phones': list(phones), 'email': email,
+            'birthday': birthday}
+
+
+class RowWriter:
+    def __init__(self, file_name, extra=()):
+        self.file = open(file_name, 'w', newline='', encoding='utf-8')
+        self.csv = None
+        if is_csv(file_name):
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(COLUMNS + tuple(extra))
+
+    def write(self, row, *extra):
+        if self.csv:
+            name, phones, email, birthday = row
+            self.csv.writerow((name, ';'.join(phones), email or '',
+                               birthday or '') + extra)
+        else:
+            item = row_item(row)
+            if extra:
+                item['error'] = extra[0]
+            self.file.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+def validate_batch(items):
+    """Check the (row, error) items that have no error yet."""
+    rows = [row for row, error in items if error is None]
+    phones = validators.validate_phones(
+        [phone for row in rows for phone in row[1]])
+    emails = validators.validate_emails([row[2] for row in rows if row[2]])
+    birthdays = validators.validate_birthdays(
+        [row[3] for row in rows if row[3]])
+    phones, emails, birthdays = iter(phones), iter(emails), iter(birthdays)
+    checked = []
+    for row, error in items:
+        if error:
+            checked.append((row, error))
+            continue
+        name, row_phones, email, birthday = row
+        errors = []
+        if not name:
+            errors.append('name is required')
+        elif not validators.is_name(name):
+            errors.append('name contains a NUL character')
+        for phone in row_phones:
+            if not next(phones):
+                errors.append(f'invalid phone {phone!r}')
+        if email and not next(emails):
+            errors.append(f'invalid email {email!r}')
+        if birthday and not next(birthdays):
+            errors.append(f'invalid birthday {birthday!r}')
+        checked.append((row, '; '.join(errors) or None))
+    return checked
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def validate_rows(items, workers=0, batch_size=BATCH_SIZE):
+    """Yield (row, error) pairs, validating batch_size items at a time.
+
+    With workers the batches are checked in a process pool, keeping only
+    a few batches in flight so the input is still streamed.
+    """
+    if not workers:
+        for batch in batches(items, batch_size):
+            yield from validate_batch(batch)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for batch in batches(items, batch_size):
+            pending.append(pool.submit(validate_batch, batch))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def import_rows(address_book, file_name, make_record, rejected_name,
+                workers=0):
+    records = []
+    rejected = 0
+    writer = None
+    try:
+        for row, error in validate_rows(read_rows(file_name), workers):
+            if error:
+                if writer is None:
+                    writer = RowWriter(rejected_name, extra=('error',))
+                writer.write(row, error)
+                rejected += 1
+            else:
+                records.append(make_record(row))
+        # The book may refuse records too, e.g. a phone another contact has.
+        refused = address_book.add_records(records)
+        for record, error in refused:
+            if writer is None:
+                writer = RowWriter(rejected_name, extra=('error',))
+            writer.write(record.to_row(), error)
+    finally:
+        if writer:
+            writer.close()
+    return len(records) - len(refused), rejected + len(refused)
+
+
+def export_rows(address_book, file_name):
+    writer = RowWriter(file_name)
+    count = 0
+    try:
+        for page in address_book.iterate(BATCH_SIZE):
+            for name, record in page:
+                writer.write((name,) + record.to_row()[1:])
+                count += 1
+    finally:
+        writer.close()
+    return count
@@ -0,0 +1,85 @@
+import re
+import time
+from datetime import date
+from functools import lru_cache
+
+from codec import FIELD_SEP
+
+PHONE_PATTERN = re.compile(r"^[\+]?3?[\s]?8?[\s]?\(?0\d{2}?\)?"
+                           r"[\s]?\d{3}[\s|-]?\d{2}[\s|-]?\d{2}$")
+EMAIL_PATTERN = re.compile(r"^[-\w\.]+@([-\w]+\.)+[-\w]{2,4}$")
+
+# How long today() trusts its cached date, in seconds.
+TODAY_TTL = 1.0
+_today = None
+_today_expires = 0.0
+
+
+def today():
+    global _today, _today_expires
+    now = time.monotonic()
+    if now >= _today_expires:
+        _today = date.today()
+        _today_expires = now + TODAY_TTL
+    return _today
+
+
+def is_name(name):
+    # The codec joins fields with FIELD_SEP, so a name holding it could be
+    # added but never saved.
+    return bool(name) and FIELD_SEP not in name
+
+
+def is_phone(phone):
+    return PHONE_PATTERN.match(phone) is not None
+
+
+def is_email(email):
+    return EMAIL_PATTERN.match(email) is not None
+
+
+@lru_cache(maxsize=65536)
+def parse_birthday(birthday):
+    """Date ordinal of a 'day.month.year' string, or None.
+
+    Same format as strptime(birthday, '%d.%m.%Y'), split by hand to skip
+    strptime's per-call format handling. Birthdays repeat a lot across a
+    book, so results are cached.
+    """
+    try:
+        day, month, year = birthday.split('.')
+    except (AttributeError, ValueError):
+        return None
+    if not (birthday.isascii() and day.isdigit() and month.isdigit()
+            and year.isdigit() and len(day) <= 2 and len(month) <= 2
+            and len(year) == 4):
+        return None
+    try:
+        return date(int(year), int(month), int(day)).toordinal()
+    except ValueError:
+        return None
+
+
+def is_birthday(birthday, ordinal=None):
+    if ordinal is None:
+        ordinal = parse_birthday(birthday)
+    return ordinal is not None and ordinal < today().toordinal()
+
+
+def validate_phones(phones):
+    match = PHONE_PATTERN.match
+    return [match(phone) is not None for phone in phones]
+
+
+def validate_emails(emails):
+    match = EMAIL_PATTERN.match
+    return [match(email) is not None for email in emails]
+
+
+def validate_birthdays(birthdays):
+    limit = today().toordinal()
+    mask = []
+    for birthday in birthdays:
+        ordinal = parse_birthday(birthday)
+        mask.append(ordinal is not None and ordinal < limit)
+    return mask